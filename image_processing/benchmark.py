@@ -0,0 +1,230 @@
+"""
+Throughput benchmark for the image_processing operators.
+
+Runs every operator on synthetic images built from the bundled pictures in
+images/ (tiled up to the requested size), reports wall time, megapixels per
+second and peak traced memory, writes the results as JSON and compares them
+against a stored baseline. Runs headless on CPU.
+
+Usage:
+    python benchmark.py                                # quick sizes, compare with benchmark_baseline.json if present
+    python benchmark.py --full                         # 256^2 up to 8K^2
+    python benchmark.py --save-baseline                # store the current run as the baseline
+    python benchmark.py --ops median_filter --sizes 512 2048
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from glob import glob
+
+import cv2
+import numpy as np
+
+from utils import apply_convolution, get_filters
+from median_filter import median_filter
+from calculate_histogram import calculate_histogram
+from equalize_histogram import equalize_histogram
+from contrast_stretch import contrast_stretch
+from calculate_gradient import calculate_gradient
+from sobel_edge_detector import sobel_edge_detector
+from directional_edge_detector import directional_edge_detector
+
+QUICK_SIZES = [256, 512, 1024]
+FULL_SIZES = [256, 512, 1024, 2048, 4096, 8192]
+KERNEL_SIZES = [3, 7, 15, 31]
+MEDIAN_SIZES = [3, 5, 9, 15]
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DEFAULT_OUTPUT = 'outputs/benchmark_results.json'
+
+
+def get_benchmark_cases():
+    """
+    All (operator, params, function) cases; function takes the test image.
+    Returns:
+        list of (op_name, params_dict, callable)
+    """
+    cases = []
+    for name, kernel in get_filters().items():
+        cases.append(('apply_convolution', {'filter': name},
+                      lambda img, kernel=kernel: apply_convolution(img, kernel)))
+    for size in KERNEL_SIZES:
+        box = np.ones((size, size)) / size**2
+        cases.append(('apply_convolution', {'filter': f'box_{size}x{size}'},
+                      lambda img, box=box: apply_convolution(img, box)))
+    for size in MEDIAN_SIZES:
+        cases.append(('median_filter', {'size': size},
+                      lambda img, size=size: median_filter(img, size)))
+    cases += [
+        ('calculate_histogram', {'bins': 256}, lambda img: calculate_histogram(img, 256)),
+        ('equalize_histogram', {'nbins': 256}, lambda img: equalize_histogram(img)),
+        ('contrast_stretch', {}, lambda img: contrast_stretch(img, int(img.min()), int(img.max()) + 1)),
+        ('calculate_gradient', {}, lambda img: calculate_gradient(img)),
+        ('sobel_edge_detector', {'threshold': 250}, lambda img: sobel_edge_detector(img, 250)),
+        ('directional_edge_detector', {'range': [40, 50]},
+         lambda img: directional_edge_detector(img, (40, 50))),
+    ]
+    return cases
+
+
+def make_test_image(size, image_dir='images'):
+    """
+    Square uint8 test image of side `size` made by tiling the bundled images
+    side by side (real texture and edges, unlike random noise).
+    """
+    tiles = []
+    for path in sorted(glob(os.path.join(image_dir, '*'))):
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if img is not None:
+            tiles.append(cv2.resize(img, (256, 256), interpolation=cv2.INTER_AREA))
+    if not tiles:
+        raise FileNotFoundError(f"No readable images in {image_dir}")
+
+    strip = np.hstack(tiles)
+    reps_y = -(-size // strip.shape[0])
+    reps_x = -(-size // strip.shape[1])
+    return np.ascontiguousarray(np.tile(strip, (reps_y, reps_x))[:size, :size])
+
+
+def case_key(result):
+    """Identity of a benchmark case, used to match results against the baseline."""
+    return f"{result['op']}|{json.dumps(result['params'], sort_keys=True)}|{result['size']}"
+
+
+def run_case(func, img, repeats):
+    """
+    Time func(img) and measure its peak memory.
+    Returns:
+        best wall time over `repeats` runs (seconds), peak traced memory (bytes)
+    """
+    # Operators such as sobel_edge_detector print diagnostics, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func(img)
+            times.append(time.perf_counter() - start)
+
+        # Separate run for memory, tracemalloc slows allocations down
+        tracemalloc.start()
+        func(img)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return min(times), peak
+
+
+def run_benchmarks(sizes, ops=None, repeats=3, image_dir='images'):
+    """
+    Run every case (optionally only the operators in `ops`) at every size.
+    Returns:
+        list of result dicts: op, params, size, seconds, mpix_per_s, peak_mb
+    """
+    results = []
+    for size in sizes:
+        img = make_test_image(size, image_dir)
+        megapixels = img.size / 1e6
+        for op, params, func in get_benchmark_cases():
+            if ops and op not in ops:
+                continue
+            seconds, peak = run_case(func, img, repeats)
+            result = {
+                'op': op,
+                'params': params,
+                'size': size,
+                'seconds': seconds,
+                'mpix_per_s': megapixels / seconds if seconds > 0 else float('inf'),
+                'peak_mb': peak / 1e6,
+            }
+            results.append(result)
+            print(f"{op:<26} {json.dumps(params):<32} {size:>5}^2  "
+                  f"{seconds*1000:>10.2f} ms  {result['mpix_per_s']:>9.2f} MP/s  {result['peak_mb']:>9.1f} MB")
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compare wall times with a baseline run.
+    Args:
+        results: current results
+        baseline: results loaded from a baseline JSON file
+        tolerance: allowed slowdown, 0.25 means up to 25% slower passes
+    Returns:
+        list of (key, baseline_seconds, current_seconds) for every regression
+    """
+    baseline_by_key = {case_key(r): r for r in baseline['results']}
+    regressions = []
+    compared = 0
+    for result in results:
+        reference = baseline_by_key.get(case_key(result))
+        if reference is None:
+            continue
+        compared += 1
+        ratio = result['seconds'] / reference['seconds'] if reference['seconds'] > 0 else 1.0
+        if ratio > 1 + tolerance:
+            regressions.append((case_key(result), reference['seconds'], result['seconds']))
+    print(f"\nCompared {compared} cases with the baseline (tolerance {tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image_processing operators")
+    parser.add_argument('--sizes', type=int, nargs='+', help="image sides to run (default: quick set)")
+    parser.add_argument('--full', action='store_true', help="run 256^2 up to 8K^2")
+    parser.add_argument('--ops', nargs='+', help="only run these operators")
+    parser.add_argument('--repeats', type=int, default=3, help="timed runs per case, best is kept")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="where to write the JSON results")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before failing")
+    args = parser.parse_args()
+
+    sizes = args.sizes or (FULL_SIZES if args.full else QUICK_SIZES)
+    results = run_benchmarks(sizes, args.ops, args.repeats)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} REGRESSION(S):")
+        for key, before, after in regressions:
+            print(f"  {key}: {before*1000:.2f} ms -> {after*1000:.2f} ms ({after/before:.2f}x)")
+        return 1
+
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Content-addressed memoization of operator results.
+
+Results of the wrapped operators (calculate_gradient, apply_convolution,
+median_filter) are keyed by a hash of the input array bytes (plus dtype and
+shape) and of every other argument, so analysing the same frame again (e.g.
+sobel_edge_detector, directional_edge_detector and the gradient demo on one
+image) costs one computation. Entries are evicted least recently used first
+once their total size passes the byte budget.
+
+The cache is off by default, like instrumentation. Cached results are returned
+read-only because the same array is handed to every caller; copy one before
+modifying it. Calls that write into caller buffers (magnitude_out=..., out=...)
+bypass the cache.
+
+Usage:
+    import cache
+    cache.enable(max_bytes=512 * 2**20)
+    ...
+    print(cache.CACHE.stats())
+"""
+import functools
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import xxhash  # optional, several times faster than blake2b on large arrays
+except ImportError:
+    xxhash = None
+
+DEFAULT_CACHE_BYTES = 256 * 2**20
+
+ENABLED = False
+
+
+def array_digest(arr):
+    """
+    Hash of an array's contents, dtype and shape (xxh3-128 if xxhash is installed, else blake2b-128).
+    """
+    arr = np.ascontiguousarray(arr)
+    data = memoryview(arr).cast('B') if arr.size else b''
+    if xxhash is not None:
+        hasher = xxhash.xxh3_128()
+    else:
+        hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{arr.dtype.str}{arr.shape}".encode())
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def make_key(name, arguments):
+    """
+    Cache key of a call: arrays are hashed by content, other arguments by repr.
+    Args:
+        name: qualified name of the function
+        arguments: dict parameter name -> value with defaults applied, so
+                   f(img, 5) and f(img, size=5) share an entry
+    """
+    def describe(value):
+        if isinstance(value, np.ndarray):
+            return ('array', array_digest(value))
+        return repr(value)
+
+    return (name, tuple((key, describe(value)) for key, value in arguments.items()))
+
+
+def result_nbytes(result):
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, tuple):
+        return sum(item.nbytes for item in result if isinstance(item, np.ndarray))
+    return 0
+
+
+def freeze(result):
+    """Mark every array of a result read-only, cached results are shared between callers."""
+    for item in (result if isinstance(result, tuple) else (result,)):
+        if isinstance(item, np.ndarray):
+            item.flags.writeable = False
+    return result
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache bounded by the total bytes of the cached arrays.
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (result, nbytes), least recently used first
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns:
+            (True, result) on a hit, (False, None) on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, key, result):
+        nbytes = result_nbytes(result)
+        if nbytes > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (result, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict with hits, misses, hit_rate, evictions, entries, current and max bytes
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+CACHE = ResultCache()
+
+
+def enable(max_bytes=None):
+    """
+    Turn memoization on for the wrapped operators.
+    Args:
+        max_bytes: optional new byte budget of the shared cache
+    """
+    global ENABLED
+    if max_bytes is not None:
+        CACHE.max_bytes = max_bytes
+    ENABLED = True
+
+
+def disable(clear=True):
+    """Turn memoization off, by default also dropping the cached results."""
+    global ENABLED
+    ENABLED = False
+    if clear:
+        CACHE.clear()
+
+
+def is_enabled():
+    return ENABLED
+
+
+def memoize(func):
+    """
+    Decorator caching func's results in CACHE while the cache is enabled.
+    Calls with an output buffer argument (a keyword ending in 'out' that is not
+    None) always run func, their results live in the caller's arrays.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        if any(value is not None for key, value in bound.arguments.items() if key.endswith('out')):
+            return func(*args, **kwargs)
+        key = make_key(name, bound.arguments)
+        hit, result = CACHE.get(key)
+        if hit:
+            return result
+        result = freeze(func(*args, **kwargs))
+        CACHE.put(key, result)
+        return result
+
+    return wrapper
+
+
+if __name__ == "__main__":
+    import time
+    import cv2
+    from calculate_gradient import calculate_gradient
+    from sobel_edge_detector import sobel_edge_detector
+    from directional_edge_detector import directional_edge_detector
+    # The operators use the imported module, not this __main__ copy
+    from cache import CACHE, enable, disable
+
+    img = cv2.imread('images/fruits.png', cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        print("Error: Could not load image")
+    else:
+        def analyse():
+            calculate_gradient(img)
+            sobel_edge_detector(img, 250)
+            for direction_range in [(0, 10), (40, 50), (85, 95), (130, 140)]:
+                directional_edge_detector(img, direction_range)
+
+        for label in ('uncached', 'cached'):
+            if label == 'cached':
+                enable()
+            start = time.perf_counter()
+            analyse()
+            print(f"{label}: {(time.perf_counter() - start) * 1000:.1f} ms")
+        print(f"Cache: {CACHE.stats()}")
+        print(f"Hash backend: {'xxhash' if xxhash is not None else 'blake2b'}")
+        disable()
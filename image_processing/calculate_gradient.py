@@ -1,36 +1,111 @@
 import numpy as np
-from utils import apply_convolution, get_sobel_kernels
+from instrumentation import instrument
+from cache import memoize
 
-def calculate_gradient(img):
+
+@instrument
+@memoize
+def calculate_gradient(img, magnitude_out=None, angle_out=None):
     """
     Calculate gradient magnitude and direction using Sobel operators.
     
     Args:
         img: 2D numpy array (grayscale image)
+        magnitude_out: optional float32 array (same shape as img) to write the magnitude into
+        angle_out: optional float32 array (same shape as img) to write the direction into
     
     Returns:
-        grad_magnitude: gradient magnitude
-        grad_angle: gradient direction in degrees [0, 360)
+        grad_magnitude: gradient magnitude (float32)
+        grad_angle: gradient direction in degrees [0, 360) (float32)
+    """
+    _, _, grad_magnitude, grad_angle = sobel_gradient(img, magnitude_out=magnitude_out,
+                                                      angle_out=angle_out)
+    # grad_angle = grad_angle % 180  # Map to [0, 180) since direction is ambiguous
+    return grad_magnitude, grad_angle
+
+
+@instrument
+def calculate_gradient_batch(images, magnitude_out=None, angle_out=None):
     """
-    # Get Sobel kernels
-    Sx, Sy = get_sobel_kernels()
+    calculate_gradient on an (N, H, W) stack; the fused Sobel pass slices the last
+    two axes, so every frame goes through the same vectorized operations.
     
-    # Apply Sobel filters
-    Gx = apply_convolution(img.astype(np.float64), Sx)
-    Gy = apply_convolution(img.astype(np.float64), Sy)
+    Args:
+        images: 3D numpy array (N, H, W)
+        magnitude_out, angle_out: optional float32 (N, H, W) output buffers
     
-    # Calculate gradient magnitude
-    grad_magnitude = np.sqrt(Gx**2 + Gy**2)
+    Returns:
+        grad_magnitude, grad_angle: (N, H, W) float32 stacks
+    """
+    if images.ndim != 3:
+        raise ValueError(f"Expected an (N, H, W) stack, got shape {images.shape}")
+    return calculate_gradient(images, magnitude_out=magnitude_out, angle_out=angle_out)
+
+
+@instrument
+def sobel_gradient(img, gx_out=None, gy_out=None, magnitude_out=None, angle_out=None):
+    """
+    Fused Sobel gradient: Gx, Gy, magnitude and angle from one padded copy of the image.
+    Same kernels and zero padding as apply_convolution with get_sobel_kernels(), but the
+    responses stay signed (no [0, 255] clip) and accumulate in float32.
+    Both Sobel kernels are a [1, 2, 1] smoothing times a [-1, 0, 1] difference:
+        Gx (sobel_horizontal) = rows below - rows above, smoothed along x
+        Gy (sobel_vertical)   = right columns - left columns, smoothed along y
     
-    # Calculate gradient direction (in radians, then convert to degrees)
-    grad_angle = np.arctan2(Gy, Gx)
+    Args:
+        img: 2D numpy array (grayscale image), or an (N, H, W) stack
+        gx_out, gy_out, magnitude_out, angle_out: optional float32 arrays
+            (same shape as img) to write the results into
     
+    Returns:
+        Gx, Gy: signed Sobel responses
+        grad_magnitude: sqrt(Gx^2 + Gy^2)
+        grad_angle: arctan2(Gy, Gx) in degrees [0, 360)
+    """
+    img_h, img_w = img.shape[-2:]
+    pad_width = [(0, 0)] * (img.ndim - 2) + [(1, 1), (1, 1)]
+
+    # Single float32 copy with zero padding, shared by both kernels
+    padded = np.pad(img.astype(np.float32, copy=False), pad_width, mode='constant', constant_values=0)
+
+    # Use the caller's buffers where given, otherwise allocate float32 outputs
+    Gx, Gy, grad_magnitude, grad_angle = [
+        np.empty(img.shape, dtype=np.float32) if buffer is None else buffer
+        for buffer in (gx_out, gy_out, magnitude_out, angle_out)
+    ]
+
+    # Gx: [1, 2, 1] along x on the row below minus the row above.
+    # The smoothed rows are built in Gy's buffer, which is overwritten right after.
+    top, mid, bottom = padded[..., :-2, :], padded[..., 1:-1, :], padded[..., 2:, :]
+    np.subtract(bottom[..., :-2], top[..., :-2], out=Gx)
+    Gx += bottom[..., 2:]
+    Gx -= top[..., 2:]
+    np.subtract(bottom[..., 1:-1], top[..., 1:-1], out=Gy)
+    Gy *= 2
+    Gx += Gy
+
+    # Gy: [1, 2, 1] along y on the right column minus the left column
+    left, right = padded[..., :, :-2], padded[..., :, 2:]
+    np.subtract(right[..., :-2, :], left[..., :-2, :], out=Gy)
+    Gy += right[..., 2:, :]
+    Gy -= left[..., 2:, :]
+    # middle row, weight 2, reuses the magnitude buffer as scratch
+    np.subtract(right[..., 1:-1, :], left[..., 1:-1, :], out=grad_magnitude)
+    grad_magnitude *= 2
+    Gy += grad_magnitude
+
+    # Calculate gradient magnitude
+    np.hypot(Gx, Gy, out=grad_magnitude)
+
+    # Calculate gradient direction (in radians, then convert to degrees)
+    np.arctan2(Gy, Gx, out=grad_angle)
+
     # Convert to degrees and ensure range [0, 360)
-    grad_angle = np.degrees(grad_angle)
-    grad_angle = (grad_angle + 360) % 360
-    # grad_angle = grad_angle % 180  # Map to [0, 180) since direction is ambiguous
-    
-    return grad_magnitude, grad_angle
+    np.degrees(grad_angle, out=grad_angle)
+    grad_angle += 360
+    np.mod(grad_angle, 360, out=grad_angle)
+
+    return Gx, Gy, grad_magnitude, grad_angle
 
 
 if __name__ == "__main__":
@@ -111,11 +186,14 @@ if __name__ == "__main__":
         print(f"Noisy gradient - Mean: {np.mean(grad_mag_noisy):.2f}, Std: {np.std(grad_mag_noisy):.2f}")
         print(f"Filtered gradient - Mean: {np.mean(grad_mag_filtered):.2f}, Std: {np.std(grad_mag_filtered):.2f}")
         #Median filtering reduces the standard deviation significantly, indicating noise reduction.
-        # Why getting inf std?
+        # Why getting inf std? (fixed)
         """
             arrmean = umr_sum(arr, axis, dtype, keepdims=True, where=where)
             Clean gradient - Mean: 6.22, Std: inf
             Noisy gradient - Mean: 6.02, Std: inf
             Filtered gradient - Mean: 5.45, Std: inf
             Filtered gradient magnitude is valid.
+            Gx and Gy used to come back from apply_convolution as uint8, so Gx**2 wrapped
+            around and np.sqrt of a uint8 array returns float16, which overflows in np.std.
+            sobel_gradient keeps signed float32 responses, so the std is finite now.
         """
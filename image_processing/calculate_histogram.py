@@ -1,5 +1,7 @@
 import numpy as np
+from instrumentation import instrument
 
+@instrument
 def calculate_histogram(img, bins):
     """
     Function to calculate histogram and normalized histogram 
@@ -11,34 +13,133 @@ def calculate_histogram(img, bins):
         counts: histogram counts in each bin (1d array of size bins)
         dist: normalized histogram, counts/total_counts
     """
-    # Initialize counts array
-    counts = np.zeros(bins, dtype=np.int64)
+    counts = histogram_counts(img, bins)
+
+    # normalize
+    total_pixels = img.size
+    dist = counts.astype(np.float64) / total_pixels # convert to float for accurate division
+
+    return counts, dist
+
+
+def histogram_counts(img, bins):
+    """
+    Histogram counts with np.bincount, no Python loop over pixels.
+    A pixel goes to bin int(pixel_val / bin_width) with bin_width = 256 / bins,
+    values past the last bin are clipped into it.
+    Args:
+        img: numpy array of any shape (grayscale image, tile, stack of frames)
+        bins: number of bins
     
+    Returns:
+        counts: histogram counts in each bin (int64 array of size bins)
+    """
     # Calculate bin width, 1 in this case
     bin_width = 256.0 / bins
+
+    if img.dtype == np.uint8:
+        # Count the 256 levels once, then merge them into bins through a 256-entry
+        # bin index table built with the same formula as for any other pixel
+        level_counts = np.bincount(img.ravel(), minlength=256)
+        bin_of_level = np.minimum((np.arange(256) / bin_width).astype(np.int64), bins - 1)
+        return np.bincount(bin_of_level, weights=level_counts, minlength=bins).astype(np.int64)
+
+    # if bin width was 10, pixel value 23 would go to bin index 2 (23/10 = 2.3 -> truncate -> 2)
+    bin_idx = (img.ravel() / bin_width).astype(np.int64)
+    # clip values greater than max to last bin (and negative values to the first)
+    np.clip(bin_idx, 0, bins - 1, out=bin_idx)
+    return np.bincount(bin_idx, minlength=bins)
+
+
+@instrument
+def calculate_histogram_batch(images, bins):
+    """
+    calculate_histogram for every frame of an (N, H, W) stack in one bincount:
+    frame n's bin indices are offset by n * bins so all histograms share one pass.
+    Args:
+        images: 3D numpy array (N, H, W)
+        bins: number of bins
     
-    # Flatten image for 1D processing
-    img_flat = img.flatten()
-    
-    # Count pixels in each bin
-    for pixel_val in img_flat:
-        # Determine which bin this pixel belongs to, 
-        # if bin width was 10, pixel value 23 would go to bin index 2 (23/10 = 2.3 -> int() -> 2)
-        bin_idx = int(pixel_val / bin_width)
-
-        # clip values greater than max to last bin
-        if bin_idx >= bins:
-            bin_idx = bins - 1
-        
-        counts[bin_idx] += 1 # increment count for that bin
-    
-    # normalize
-    total_pixels = img.size
-    dist = counts.astype(np.float64) / total_pixels # convert to float for accurate division
+    Returns:
+        counts: (N, bins) histogram counts per frame
+        dist: (N, bins) normalized histograms
+    """
+    if images.ndim != 3:
+        raise ValueError(f"Expected an (N, H, W) stack, got shape {images.shape}")
+    n_frames = len(images)
+    bin_width = 256.0 / bins
+    frame_offsets = np.arange(n_frames)[:, None]
 
+    if images.dtype == np.uint8:
+        # Per-frame counts of the 256 levels, then levels merged into bins as in histogram_counts
+        levels = images.reshape(n_frames, -1).astype(np.int64) + frame_offsets * 256
+        level_counts = np.bincount(levels.ravel(), minlength=n_frames * 256).reshape(n_frames, 256)
+        bin_of_level = np.minimum((np.arange(256) / bin_width).astype(np.int64), bins - 1)
+        counts = np.zeros((n_frames, bins), dtype=np.int64)
+        np.add.at(counts, (slice(None), bin_of_level), level_counts)
+    else:
+        bin_idx = (images.reshape(n_frames, -1) / bin_width).astype(np.int64)
+        np.clip(bin_idx, 0, bins - 1, out=bin_idx)
+        bin_idx += frame_offsets * bins
+        counts = np.bincount(bin_idx.ravel(), minlength=n_frames * bins).reshape(n_frames, bins)
+
+    dist = counts.astype(np.float64) / (images[0].size if n_frames else 1)
     return counts, dist
 
 
+class HistogramAccumulator:
+    """
+    Streaming histogram over many images or tiles.
+    Counts are integers, so partial histograms built in worker processes can be
+    merged exactly in any order; the accumulator itself pickles cheaply.
+    
+    Usage:
+        acc = HistogramAccumulator(256)
+        for tile in tiles:
+            acc.add(tile)
+        acc.merge(other_acc)
+        counts, dist = acc.counts, acc.dist
+    """
+
+    def __init__(self, bins):
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.total = 0
+
+    def add(self, img):
+        """Add the pixels of an image, tile or stack of frames."""
+        self.counts += histogram_counts(img, self.bins)
+        self.total += img.size
+        return self
+
+    def add_counts(self, counts):
+        """Add an already computed counts array (e.g. from calculate_histogram)."""
+        counts = np.asarray(counts, dtype=np.int64)
+        if counts.shape != (self.bins,):
+            raise ValueError(f"Expected counts of shape ({self.bins},), got {counts.shape}")
+        self.counts += counts
+        self.total += int(counts.sum())
+        return self
+
+    def merge(self, other):
+        """Fold another accumulator with the same number of bins into this one."""
+        if other.bins != self.bins:
+            raise ValueError(f"Cannot merge histograms with {other.bins} and {self.bins} bins")
+        self.counts += other.counts
+        self.total += other.total
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def dist(self):
+        """Normalized histogram, counts/total_counts."""
+        if self.total == 0:
+            return np.zeros(self.bins, dtype=np.float64)
+        return self.counts.astype(np.float64) / self.total
+
+
 if __name__ == "__main__":
     import cv2
     import matplotlib.pyplot as plt
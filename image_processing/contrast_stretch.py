@@ -1,8 +1,8 @@
 import numpy as np
 from utils import clip_image
-import cv2
-import matplotlib.pyplot as plt
+from instrumentation import instrument
 
+@instrument
 def contrast_stretch(img, r_min, r_max):
     """
     Maps the intensity range [r_min, r_max] of an image to the full output range [0, 255] linearly.
@@ -30,7 +30,46 @@ def contrast_stretch(img, r_min, r_max):
     # convert to uint8 because images are usually in this format, if not converted, matplotlib may not display correctly
     return new_img.astype(np.uint8) 
 
+@instrument
+def contrast_stretch_batch(images, r_min=None, r_max=None):
+    """
+    contrast_stretch on an (N, H, W) stack with one intensity range per frame.
+    When a range comes from the frames themselves (r_min or r_max left as None),
+    a constant frame (e.g. a black video frame) has nothing to stretch and is
+    passed through unchanged (clipped to uint8) instead of failing the batch;
+    explicit ranges with r_max <= r_min still raise ValueError.
+    
+    Args:
+        images: 3D numpy array (N, H, W)
+        r_min: scalar or array of N minimums, defaults to each frame's own minimum
+        r_max: scalar or array of N maximums, defaults to each frame's own maximum
+    
+    Returns:
+        new_images: contrast stretched stack (uint8)
+    """
+    if images.ndim != 3:
+        raise ValueError(f"Expected an (N, H, W) stack, got shape {images.shape}")
+
+    explicit = r_min is not None and r_max is not None
+    r_min = np.min(images, axis=(1, 2)) if r_min is None else r_min
+    r_max = np.max(images, axis=(1, 2)) if r_max is None else r_max
+
+    # Per-frame ranges broadcast as (N, 1, 1) against the stack
+    r_min = np.broadcast_to(np.asarray(r_min, dtype=np.float64), (len(images),))[:, None, None]
+    r_max = np.broadcast_to(np.asarray(r_max, dtype=np.float64), (len(images),))[:, None, None]
+    flat = (r_max <= r_min)[:, 0, 0]
+    if explicit and np.any(flat):
+        raise ValueError("r_max must be greater than r_min")
+
+    # Apply contrast stretch to every frame at once (unit span for the flat frames, replaced below)
+    new_images = ((images - r_min) / np.where(flat[:, None, None], 1.0, r_max - r_min)) * 255.0
+    new_images[flat] = images[flat]
+    new_images = clip_image(new_images, 0, 255)
+    return new_images.astype(np.uint8)
+
 if __name__ == "__main__":
+    import cv2
+    import matplotlib.pyplot as plt
     
     # Load a low-contrast image
     img = cv2.imread('images/low_contrast.png', cv2.IMREAD_GRAYSCALE)
@@ -1,7 +1,9 @@
 import numpy as np
 from calculate_gradient import calculate_gradient
+from instrumentation import instrument
 
-def directional_edge_detector(img, direction_range):
+@instrument
+def directional_edge_detector(img, direction_range, magnitude_threshold=None, gradient=None):
     """
     Detect edges in a specific direction range.
     
@@ -9,38 +11,68 @@ def directional_edge_detector(img, direction_range):
         img: 2D numpy array (grayscale image)
         direction_range: tuple (min_angle, max_angle) in degrees
                         e.g., (40, 50) for roughly 45-degree edges
+        magnitude_threshold: optional, only keep pixels whose gradient magnitude is above it
+        gradient: optional (grad_magnitude, grad_angle) from calculate_gradient(img), skips recomputing it
     
     Returns:
         edge_directional_map: binary map showing edges in the specified direction
     """
-    # Calculate gradient magnitude and direction
-    grad_magnitude, grad_angle = calculate_gradient(img)
-    
-    min_angle, max_angle = direction_range
-    
-    # Initialize output map
-    edge_directional_map = np.zeros_like(grad_magnitude, dtype=np.uint8)
+    return directional_edge_maps(img, {'range': direction_range}, magnitude_threshold, gradient)['range']
+
+
+@instrument
+def directional_edge_maps(img, directions, magnitude_threshold=None, gradient=None):
+    """
+    Edge maps for several direction ranges from one gradient computation.
+    The gradient (and the magnitude mask) is computed once for all ranges; each
+    range then costs two in-place comparisons on the angle, which is cheaper
+    than binning the angles first (np.searchsorted is a binary search per pixel).
+    A range with min_angle > max_angle wraps around 0 (e.g. (350, 10)), both ends
+    are inclusive as in directional_edge_detector.
     
-    if min_angle <= max_angle:
-        # for angles in range without wrapping, example works for 0-10, 40-50, 85-95, 130-140
-        # Wont work for ranges 359-370 which is essentially 359-10. In that case, use the else part.
-        mask = (grad_angle >= min_angle) & (grad_angle <= max_angle)
-    else:
-        # Wrapping case when ranges have to cross 0 because min_angle > max_angle, eg min angle=350, max_angle=10.
-        # What this 
-        mask = (grad_angle >= min_angle) | (grad_angle <= max_angle)
+    Args:
+        img: 2D numpy array (grayscale image), ignored if gradient is given
+        directions: dict name -> (min_angle, max_angle) in degrees
+        magnitude_threshold: optional, pixels with gradient magnitude <= threshold
+                             (flat regions) are left out of every map
+        gradient: optional (grad_magnitude, grad_angle) from calculate_gradient(img)
     
+    Returns:
+        edge_maps: dict name -> binary map (255 for edges in that direction, 0 otherwise)
+    """
+    # Calculate gradient magnitude and direction once for all directions
+    grad_magnitude, grad_angle = calculate_gradient(img) if gradient is None else gradient
+    dtype = grad_angle.dtype
+    strong = None if magnitude_threshold is None else grad_magnitude > magnitude_threshold
 
-    # Set edges in the specified direction to 255
-    edge_directional_map[mask] = 255
-    
-    return edge_directional_map
+    # Scratch masks reused by every direction
+    inside = np.empty(grad_angle.shape, dtype=bool)
+    upper = np.empty(grad_angle.shape, dtype=bool)
+    edge_maps = {}
+    for name, (min_angle, max_angle) in directions.items():
+        # Bounds in the angle dtype so the comparisons are exact on float32 angles
+        min_angle, max_angle = dtype.type(min_angle), dtype.type(max_angle)
+        np.greater_equal(grad_angle, min_angle, out=inside)
+        np.less_equal(grad_angle, max_angle, out=upper)
+        if min_angle <= max_angle:
+            # for angles in range without wrapping, example works for 0-10, 40-50, 85-95, 130-140
+            # Wont work for ranges 359-370 which is essentially 359-10. In that case, use the else part.
+            np.logical_and(inside, upper, out=inside)
+        else:
+            # Wrapping case when ranges have to cross 0 because min_angle > max_angle, eg min angle=350, max_angle=10.
+            np.logical_or(inside, upper, out=inside)
+        if strong is not None:
+            np.logical_and(inside, strong, out=inside)
+        edge_map = np.empty(grad_angle.shape, dtype=np.uint8)
+        np.multiply(inside, np.uint8(255), out=edge_map)
+        edge_maps[name] = edge_map
 
+    return edge_maps
 
 if __name__ == "__main__":
     import cv2
     import matplotlib.pyplot as plt
-    from sobel_edge_detector import sobel_edge_detector
+    from sobel_edge_detector import sobel_edge_detector, auto_threshold
     
     # Load image
     image_name = "fruits.png"
@@ -62,8 +94,16 @@ if __name__ == "__main__":
             'Diagonal 135°': (130, 140)
         }
         
+        # All directional maps from the gradient above, angle only and with the Sobel
+        # magnitude threshold (drops the flat regions whose angle is just noise)
+        directional_maps = directional_edge_maps(img, directions, gradient=(grad_magnitude, grad_angle))
+        # Otsu threshold of the magnitude (about 268 on fruits.png)
+        magnitude_threshold = auto_threshold(grad_magnitude, 'otsu')
+        directional_maps_strong = directional_edge_maps(img, directions, magnitude_threshold=magnitude_threshold,
+                                                        gradient=(grad_magnitude, grad_angle))
+        
         # Apply Sobel edge detector (magnitude-based)
-        sobel_edges = sobel_edge_detector(img, threshold=8)
+        sobel_edges = sobel_edge_detector(img, threshold=magnitude_threshold, grad_magnitude=grad_magnitude)
         
         # Apply Canny edge detector (OpenCV implementation)
         canny_edges = cv2.Canny(img, threshold1=50, threshold2=150)
@@ -94,7 +134,7 @@ if __name__ == "__main__":
         # Directional edge detections
         plot_idx = 4
         for direction_name, direction_range in directions.items():
-            directional_edges = directional_edge_detector(img, direction_range)
+            directional_edges = directional_maps[direction_name]
             
             ax = plt.subplot(3, 3, plot_idx)
             ax.imshow(directional_edges, cmap='gray')
@@ -106,7 +146,7 @@ if __name__ == "__main__":
         # Sobel edge detector (magnitude-based)
         ax_sobel = plt.subplot(3, 3, 8)
         ax_sobel.imshow(sobel_edges, cmap='gray')
-        ax_sobel.set_title('Sobel Edge Detector\n(Magnitude-based, threshold=50)')
+        ax_sobel.set_title(f'Sobel Edge Detector\n(Magnitude-based, threshold={magnitude_threshold:.0f})')
         ax_sobel.axis('off')
         
         # Canny edge detector
@@ -128,7 +168,7 @@ if __name__ == "__main__":
         axes[0].axis('off')
         
         # Directional (45 degrees)
-        directional_45 = directional_edge_detector(img, (40, 50))
+        directional_45 = directional_maps['Diagonal 45°']
         axes[1].imshow(directional_45, cmap='gray')
         axes[1].set_title('Directional (45° Edges)')
         axes[1].axis('off')
@@ -173,4 +213,6 @@ if __name__ == "__main__":
         print("\n=== Edge Pixel Statistics ===")
         print(f"Sobel: {sobel_count} pixels ({100*sobel_count/total_pixels:.2f}%)")
         print(f"Directional (45°): {directional_count} pixels ({100*directional_count/total_pixels:.2f}%)")
+        strong_count = np.sum(directional_maps_strong['Diagonal 45°'] == 255)
+        print(f"Directional (45°, magnitude > {magnitude_threshold:.0f}): {strong_count} pixels ({100*strong_count/total_pixels:.2f}%)")
         print(f"Canny: {canny_count} pixels ({100*canny_count/total_pixels:.2f}%)")
\ No newline at end of file
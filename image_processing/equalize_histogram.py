@@ -1,46 +1,134 @@
 import numpy as np
-from calculate_histogram import calculate_histogram
+from calculate_histogram import calculate_histogram, calculate_histogram_batch
+from instrumentation import instrument
 
-def equalize_histogram(img, nbins=256):
+@instrument
+def equalize_histogram(img, nbins=256, out=None, per_frame=True):
     """
     Histogram equalization.
     Steps:
     1. Calculate histogram and normalize it
     2. Calculate cdf
     3. scale original pixels with cdf and 255
+    Steps 2-3 are folded into a 256-entry lookup table (equalization_lut),
+    which is applied to the whole image with one gather.
     
     Args:
-        img: 2D numpy array of grayscale image
+        img: 2D numpy array of grayscale image, or an (N, H, W) stack of frames
+        nbins: number of histogram bins
+        out: optional uint8 array of img's shape to write into
+             (pass out=img to equalize a uint8 image in place)
+        per_frame: for a stack, True builds one LUT per frame,
+                   False builds one LUT from the histogram of the whole stack
     
     Returns:
-        new_img: histogram equalized image
+        new_img: histogram equalized image (uint8)
     """
+    if out is None:
+        out = np.empty(img.shape, dtype=np.uint8)
+
+    if img.ndim == 3 and per_frame:
+        return equalize_histogram_batch(img, nbins, out=out)
+
     # Calculate histogram with 256 bins, 1 bin for 1 pixel value
+    # (a stack without per_frame counts every frame into one shared histogram)
     counts, dist = calculate_histogram(img, nbins)
+
+    if img.dtype == np.uint8:
+        return apply_equalization_lut(img, equalization_lut(dist), out=out)
+
+    # Other dtypes can't index a LUT, bin them like calculate_histogram does
+    cdf = np.cumsum(dist)
+    bin_width = 256 / nbins
+    bin_idx = np.clip((img / bin_width).astype(np.int64), 0, nbins - 1)
+    out[...] = cdf[bin_idx] * 255
+    return out
+
+
+@instrument
+def equalize_histogram_batch(images, nbins=256, out=None):
+    """
+    Histogram equalization of every frame of an (N, H, W) stack with its own LUT.
+    All N histograms come from one bincount, all N LUTs from one cumsum, and
+    all N LUTs are applied with one gather (row n of the LUT table for frame n).
+    
+    Args:
+        images: 3D numpy array (N, H, W)
+        nbins: number of histogram bins
+        out: optional uint8 (N, H, W) array to write into, may be images itself
     
+    Returns:
+        new_images: equalized stack (uint8)
+    """
+    if images.ndim != 3:
+        raise ValueError(f"Expected an (N, H, W) stack, got shape {images.shape}")
+    if out is None:
+        out = np.empty(images.shape, dtype=np.uint8)
+
+    counts, dist = calculate_histogram_batch(images, nbins)
+
+    if images.dtype == np.uint8:
+        luts = equalization_lut(dist)
+        # The gather builds its result before writing, so out may be images itself
+        out[...] = luts[np.arange(len(images))[:, None, None], images]
+        return out
+
+    # Other dtypes can't index a LUT, bin them like calculate_histogram does
+    cdf = np.cumsum(dist, axis=1)
+    bin_width = 256 / nbins
+    bin_idx = np.clip((images / bin_width).astype(np.int64), 0, nbins - 1)
+    out[...] = np.take_along_axis(cdf, bin_idx.reshape(len(images), -1), axis=1).reshape(images.shape) * 255
+    return out
+
+
+def equalization_lut(dist):
+    """
+    Build the equalization lookup table from a normalized histogram.
+    lut[v] = int(cdf[bin of v] * 255) for every 8-bit level v.
+    
+    Args:
+        dist: normalized histogram from calculate_histogram (size nbins),
+              or (N, nbins) histograms for one LUT per row
+    
+    Returns:
+        lut: uint8 array of size 256 (or (N, 256))
+    """
+    nbins = dist.shape[-1]
+
     # Calculate cdf
-    cdf = np.cumsum(dist) # shape is no. of bins
+    cdf = np.cumsum(dist, axis=-1) # shape is no. of bins
 
-    new_img = np.zeros_like(img, dtype=np.uint8)
     bin_width = 256 / nbins # for 256 bins, each bin covers 1 pixel value, for nbin = 1
 
-    # Map each pixel to its equalized value
-    for i in range(img.shape[0]):
-        for j in range(img.shape[1]):
-            pixel_value = img[i, j]
-            
-            # Determine which bin this pixel belongs to
-            bin_idx = int(pixel_value / bin_width)
-            
-            # Handle edge case where pixel value is exactly 255
-            if bin_idx >= nbins:
-                bin_idx = nbins - 1
-            
-            # Map using CDF: scale to [0, 255]
-            new_img[i, j] = int(cdf[bin_idx] * 255)
+    # Determine which bin each level belongs to, 255 may land past the last bin
+    levels = np.arange(256)
+    bin_idx = np.minimum((levels / bin_width).astype(np.int64), nbins - 1)
+
+    # Map using CDF: scale to [0, 255]
+    return (cdf[..., bin_idx] * 255).astype(np.uint8)
+
+
+@instrument
+def apply_equalization_lut(img, lut, out=None):
+    """
+    Map every pixel of a uint8 image through an equalization LUT with one gather.
     
-    return new_img
+    Args:
+        img: uint8 numpy array (image or stack)
+        lut: uint8 array of size 256 from equalization_lut
+        out: optional uint8 array of img's shape, may be img itself
     
+    Returns:
+        new_img: equalized image (uint8)
+    """
+    if img.dtype != np.uint8:
+        raise TypeError("apply_equalization_lut needs a uint8 image")
+    if out is None:
+        out = np.empty(img.shape, dtype=np.uint8)
+
+    # mode='clip' skips the bounds-checked (buffered) path, uint8 indices are always in range
+    np.take(lut, img, out=out, mode='clip')
+    return out
 
 
 if __name__ == "__main__":
@@ -0,0 +1,325 @@
+"""
+Opt-in per-stage timing and memory instrumentation for the image_processing operators.
+
+The public operators are wrapped with @instrument. While instrumentation is
+disabled (the default) a wrapped call costs one global flag check. Once enabled,
+every call records its wall time, the time spent outside nested instrumented
+calls (self time), the size of its input image and its tracemalloc peak, so a
+chain such as noise -> median_filter -> calculate_gradient -> sobel_edge_detector
+can be broken down stage by stage.
+
+Usage:
+    import instrumentation
+    with instrumentation.instrumented():
+        edges = sobel_edge_detector(median_filter(noisy, 5), 250)
+    print(instrumentation.format_stats_table())
+    instrumentation.save_stats_json('outputs/stage_stats.json')
+
+Stats are kept per process: calls made inside ProcessPoolExecutor workers are
+not collected. With several threads, timings are per call but tracemalloc is
+process-wide, so memory peaks of concurrent stages overlap.
+"""
+import contextlib
+import functools
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+ENABLED = False
+TRACK_MEMORY = False
+# True when enable() started tracemalloc itself, so disable() only stops its own tracing
+STARTED_TRACEMALLOC = False
+PERCENTILES = (50, 95, 99)
+# Call durations kept per stage for the percentiles; past this many calls a uniform
+# reservoir sample of all calls is kept, so long runs (video, webcam) use bounded memory
+DURATION_SAMPLES = 4096
+
+stats = {}
+stats_lock = threading.Lock()
+call_stack = threading.local()
+
+
+class StageStats:
+    """
+    Accumulated measurements of one stage (one instrumented function or stage() block).
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.durations = []  # reservoir sample of at most DURATION_SAMPLES call durations
+        self.random = random.Random(0)
+        self.input_pixels = 0
+        self.last_input_shape = None
+        self.peak_memory = None  # stays None unless memory tracking was on
+
+    def add(self, duration, self_duration, shape, pixels, peak_memory):
+        self.calls += 1
+        self.total_time += duration
+        self.self_time += self_duration
+        if len(self.durations) < DURATION_SAMPLES:
+            self.durations.append(duration)
+        else:
+            # Algorithm R: the n-th call replaces a random sample with probability DURATION_SAMPLES / n
+            slot = self.random.randrange(self.calls)
+            if slot < DURATION_SAMPLES:
+                self.durations[slot] = duration
+        if shape is not None:
+            self.last_input_shape = shape
+            self.input_pixels += pixels
+        if peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, peak_memory)
+
+    def summary(self):
+        """
+        Returns:
+            dict of plain Python values (JSON serializable)
+        """
+        durations_ms = np.array(self.durations) * 1000
+        summary = {
+            'calls': self.calls,
+            'total_ms': self.total_time * 1000,
+            'self_ms': self.self_time * 1000,
+            'mean_ms': self.total_time * 1000 / self.calls,
+        }
+        for q, value in zip(PERCENTILES, np.percentile(durations_ms, PERCENTILES)):
+            summary[f'p{q}_ms'] = float(value)
+        summary['input_megapixels'] = self.input_pixels / 1e6
+        summary['mpix_per_s'] = (self.input_pixels / 1e6 / self.total_time) if self.total_time > 0 else None
+        summary['last_input_shape'] = list(self.last_input_shape) if self.last_input_shape else None
+        summary['peak_mb'] = self.peak_memory / 1e6 if self.peak_memory is not None else None
+        return summary
+
+
+def enable(memory=True):
+    """
+    Start recording instrumented calls.
+    Args:
+        memory: also track the tracemalloc peak of every stage (starts tracemalloc,
+                which slows down allocations noticeably)
+    """
+    global ENABLED, TRACK_MEMORY, STARTED_TRACEMALLOC
+    TRACK_MEMORY = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        STARTED_TRACEMALLOC = True
+    ENABLED = True
+
+
+def disable():
+    """Stop recording. Collected stats are kept until reset()."""
+    global ENABLED, TRACK_MEMORY, STARTED_TRACEMALLOC
+    ENABLED = False
+    TRACK_MEMORY = False
+    if STARTED_TRACEMALLOC:
+        tracemalloc.stop()
+        STARTED_TRACEMALLOC = False
+
+
+def is_enabled():
+    return ENABLED
+
+
+def reset():
+    """Forget all collected stats."""
+    with stats_lock:
+        stats.clear()
+
+
+@contextlib.contextmanager
+def instrumented(memory=True, clear=True):
+    """
+    Enable instrumentation for the duration of a with-block.
+    Args:
+        memory: track tracemalloc peaks, see enable()
+        clear: reset previously collected stats first
+    """
+    was_enabled, had_memory = ENABLED, TRACK_MEMORY
+    if clear:
+        reset()
+    enable(memory)
+    try:
+        yield stats
+    finally:
+        disable()
+        if was_enabled:
+            enable(had_memory)
+
+
+def input_shape(args):
+    """Shape and size of the first numpy array among the call arguments."""
+    for arg in args:
+        if isinstance(arg, np.ndarray):
+            return arg.shape, arg.size
+    return None, 0
+
+
+def begin_stage(name, args=()):
+    """Open a measurement frame, returns the token end_stage needs."""
+    frames = getattr(call_stack, 'frames', None)
+    if frames is None:
+        frames = call_stack.frames = []
+
+    current = 0
+    if TRACK_MEMORY and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        if frames:
+            # Keep the parent's peak so far, then measure this stage from its own start
+            frames[-1]['peak'] = max(frames[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+
+    shape, pixels = input_shape(args)
+    frame = {'name': name, 'shape': shape, 'pixels': pixels, 'current': current,
+             'peak': current, 'child_time': 0.0, 'start': time.perf_counter()}
+    frames.append(frame)
+    return frame
+
+
+def end_stage(frame):
+    """Close a measurement frame opened by begin_stage and record it."""
+    duration = time.perf_counter() - frame['start']
+    frames = call_stack.frames
+    frames.pop()
+
+    peak_memory = None
+    if TRACK_MEMORY and tracemalloc.is_tracing():
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        peak_memory = peak - frame['current']
+        if frames:
+            frames[-1]['peak'] = max(frames[-1]['peak'], peak)
+    if frames:
+        frames[-1]['child_time'] += duration
+
+    with stats_lock:
+        stage_stats = stats.get(frame['name'])
+        if stage_stats is None:
+            stage_stats = stats[frame['name']] = StageStats(frame['name'])
+        stage_stats.add(duration, duration - frame['child_time'], frame['shape'],
+                        frame['pixels'], peak_memory)
+
+
+@contextlib.contextmanager
+def stage(name, *arrays):
+    """
+    Instrument an arbitrary block of code as a stage, e.g. I/O or glue code
+    between operators. Does nothing while instrumentation is disabled.
+    Args:
+        name: stage name in the report
+        arrays: optional input arrays, the first one is recorded as the input size
+    """
+    if not ENABLED:
+        yield
+        return
+    frame = begin_stage(name, arrays)
+    try:
+        yield
+    finally:
+        end_stage(frame)
+
+
+def instrument(func=None, name=None):
+    """
+    Decorator recording every call of func as a stage while instrumentation is enabled.
+    Usable as @instrument or @instrument(name='...'); the stage name defaults to
+    the function name. The wrapper keeps func's name, so it still pickles for
+    process pools.
+    """
+    if func is None:
+        return functools.partial(instrument, name=name)
+    stage_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        frame = begin_stage(stage_name, args)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end_stage(frame)
+
+    return wrapper
+
+
+def get_stats():
+    """
+    Returns:
+        dict stage name -> summary dict (calls, total/self/mean/percentile ms,
+        input megapixels, throughput, peak MB), in order of first call
+    """
+    with stats_lock:
+        return {name: stage_stats.summary() for name, stage_stats in stats.items()}
+
+
+def format_stats_table(stage_summaries=None):
+    """
+    Render stats as a fixed-width text table, slowest total time first.
+    Args:
+        stage_summaries: output of get_stats(), defaults to the current stats
+    Returns:
+        table as a string
+    """
+    stage_summaries = get_stats() if stage_summaries is None else stage_summaries
+    header = (f"{'stage':<28} {'calls':>6} {'total ms':>10} {'self ms':>10} {'mean ms':>9} "
+              f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'MP/s':>8} {'peak MB':>8}")
+    lines = [header, '-' * len(header)]
+    ordered = sorted(stage_summaries.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+    for name, s in ordered:
+        mpix = f"{s['mpix_per_s']:.2f}" if s['mpix_per_s'] is not None else '-'
+        peak = f"{s['peak_mb']:.1f}" if s['peak_mb'] is not None else '-'
+        lines.append(f"{name:<28} {s['calls']:>6} {s['total_ms']:>10.2f} {s['self_ms']:>10.2f} "
+                     f"{s['mean_ms']:>9.2f} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} "
+                     f"{mpix:>8} {peak:>8}")
+    return '\n'.join(lines)
+
+
+def save_stats_json(path):
+    """
+    Write get_stats() to a JSON file.
+    Returns:
+        the saved stats dict
+    """
+    stage_summaries = get_stats()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(stage_summaries, f, indent=2)
+    return stage_summaries
+
+
+if __name__ == "__main__":
+    import io
+    import cv2
+    from median_filter import median_filter, add_salt_pepper_noise
+    from calculate_gradient import calculate_gradient
+    from sobel_edge_detector import sobel_edge_detector
+    # The operators report to the imported module, not to this __main__ copy
+    from instrumentation import instrumented, format_stats_table, save_stats_json
+
+    img = cv2.imread('images/fruits.png', cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        print("Error: Could not load image")
+    else:
+        # Overhead of a disabled wrapper
+        start = time.perf_counter()
+        for _ in range(20):
+            calculate_gradient(img)
+        t_off = time.perf_counter() - start
+
+        with instrumented():
+            with contextlib.redirect_stdout(io.StringIO()):  # sobel_edge_detector prints its range
+                for _ in range(20):
+                    noisy = add_salt_pepper_noise(img, 0.05, 0.05)
+                    filtered = median_filter(noisy, 5)
+                    calculate_gradient(filtered)
+                    sobel_edge_detector(filtered, 250)
+
+        print(format_stats_table())
+        print(f"\n20 x calculate_gradient with instrumentation disabled: {t_off*1000:.1f} ms")
+        save_stats_json('outputs/stage_stats.json')
+        print("Saved outputs/stage_stats.json")
@@ -1,23 +1,37 @@
 import numpy as np
 from calculate_gradient import calculate_gradient
+from instrumentation import instrument
 
-def sobel_edge_detector(img, threshold):
+# Bins of the gradient magnitude histogram used for automatic thresholds
+MAGNITUDE_BINS = 1024
+
+
+@instrument
+def sobel_edge_detector(img, threshold, grad_magnitude=None, verbose=True):
     """
     Apply Sobel edge detection with thresholding.
     
     Args:
         img: 2D numpy array (grayscale image)
-        threshold: threshold value for binary edge map
+        threshold: threshold value for binary edge map, or 'otsu' / 'percentile'
+                   to pick it from the image with auto_threshold
+        grad_magnitude: optional gradient magnitude from calculate_gradient(img), skips recomputing it
+        verbose: print the gradient magnitude range (False for per-frame use, e.g. video)
     
     Returns:
         edge_map: binary edge map (255 for edges, 0 for non-edges)
     """
     # Calculate gradient magnitude
-    grad_magnitude, _ = calculate_gradient(img)
-    print(f"Gradient magnitude range: [{np.min(grad_magnitude):.2f}, {np.max(grad_magnitude):.2f}]")
+    if grad_magnitude is None:
+        grad_magnitude, _ = calculate_gradient(img)
+    if verbose:
+        print(f"Gradient magnitude range: [{np.min(grad_magnitude):.2f}, {np.max(grad_magnitude):.2f}]")
     # Meaning of gradient magnitude values:
     # Low values (close to 0) indicate little change in intensity (flat regions)
     # High values indicate significant change in intensity (edges)
+
+    if isinstance(threshold, str):
+        threshold = auto_threshold(grad_magnitude, method=threshold)
     
     # Apply binary threshold
     edge_map = np.zeros_like(grad_magnitude, dtype=np.uint8)
@@ -26,6 +40,98 @@ def sobel_edge_detector(img, threshold):
     return edge_map
 
 
+@instrument
+def sobel_threshold_sweep(img, thresholds, grad_magnitude=None):
+    """
+    Sobel edge maps for a list of thresholds from one gradient computation.
+    
+    Args:
+        img: 2D numpy array (grayscale image), ignored if grad_magnitude is given
+        thresholds: iterable of threshold values
+        grad_magnitude: optional gradient magnitude from calculate_gradient(img)
+    
+    Returns:
+        edge_maps: dict threshold -> binary edge map (255 for edges, 0 for non-edges)
+        edge_percentages: dict threshold -> percentage of edge pixels
+    """
+    if grad_magnitude is None:
+        grad_magnitude, _ = calculate_gradient(img)
+
+    edge_maps = {}
+    edge_percentages = {}
+    mask = np.empty(grad_magnitude.shape, dtype=bool)
+    for threshold in thresholds:
+        np.greater(grad_magnitude, threshold, out=mask)
+        # bool -> 0/1 uint8 view, times 255 gives the edge map without a masked assignment
+        edge_maps[threshold] = mask.view(np.uint8) * np.uint8(255)
+        edge_percentages[threshold] = 100.0 * np.count_nonzero(mask) / mask.size
+    return edge_maps, edge_percentages
+
+
+def magnitude_histogram(grad_magnitude, bins=MAGNITUDE_BINS):
+    """
+    Histogram of gradient magnitudes over [0, max] with np.bincount.
+    Args:
+        grad_magnitude: numpy array of non-negative magnitudes
+        bins: number of equal-width bins
+    
+    Returns:
+        counts: int64 array of size bins
+        bin_edges: float64 array of size bins + 1
+    """
+    max_value = float(np.max(grad_magnitude))
+    if max_value <= 0:
+        # Flat image, everything in the first bin
+        return np.bincount([0], weights=[grad_magnitude.size], minlength=bins).astype(np.int64), \
+            np.linspace(0, 1, bins + 1)
+
+    scale = np.float32(bins / max_value)
+    bin_idx = (grad_magnitude * scale).astype(np.intp)
+    np.minimum(bin_idx, bins - 1, out=bin_idx)  # the maximum itself lands in the last bin
+    counts = np.bincount(bin_idx.ravel(), minlength=bins)
+    return counts, np.linspace(0, max_value, bins + 1)
+
+
+def auto_threshold(grad_magnitude, method='otsu', percentile=90, bins=MAGNITUDE_BINS):
+    """
+    Pick a Sobel threshold from the gradient magnitude histogram, so thresholds
+    don't have to be tuned by hand per image.
+    'otsu': threshold maximizing the between-class variance of flat vs edge pixels.
+    'percentile': threshold leaving (100 - percentile)% of the pixels as edges.
+    
+    Args:
+        grad_magnitude: gradient magnitude from calculate_gradient
+        method: 'otsu' or 'percentile'
+        percentile: for method='percentile'
+        bins: histogram bins, the threshold is accurate to max / bins
+    
+    Returns:
+        threshold: float, edges are pixels with magnitude > threshold
+    """
+    counts, bin_edges = magnitude_histogram(grad_magnitude, bins)
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+
+    if method == 'percentile':
+        # First bin whose cumulative count reaches the percentile, threshold at its upper edge
+        k = np.searchsorted(cumulative, total * percentile / 100.0)
+        return float(bin_edges[min(k, bins - 1) + 1])
+
+    if method != 'otsu':
+        raise ValueError(f"Unknown threshold method: {method}")
+
+    # Otsu: for a split after bin k, weights and means of both classes from cumulative sums
+    centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    weight_low = cumulative.astype(np.float64)
+    weight_high = total - weight_low
+    cumulative_mean = np.cumsum(counts * centers)
+    mean_low = cumulative_mean / np.maximum(weight_low, 1)
+    mean_high = (cumulative_mean[-1] - cumulative_mean) / np.maximum(weight_high, 1)
+    between_variance = weight_low * weight_high * (mean_low - mean_high) ** 2
+    k = int(np.argmax(between_variance))
+    return float(bin_edges[k + 1])
+
+
 if __name__ == "__main__":
     import cv2
     import matplotlib.pyplot as plt
@@ -43,12 +149,12 @@ if __name__ == "__main__":
         grad_magnitude, _ = calculate_gradient(img)
         
         # The gradient magnitude values depend on the image content and the Sobel operator's
-        # scaling. Values in the range of 0 to around 15.81 can be expected for typical images.
-        # The maximum possible gradient magnitude for an 8-bit image using Sobel filters is around 1140,
-        # but actual values are often much lower due to the nature of real-world images.
+        # scaling. The maximum possible gradient magnitude for an 8-bit image using Sobel filters
+        # is around 1140 (about 1050 on fruits.png); most pixels of real images stay far below it.
+        # Otsu picks about 268 on fruits.png and about 375 on HappyFish.jpg.
 
-        thresholds = [6, 8,10]
-        # thresholds = [10, 12,14] # for HappyFish.jpg
+        thresholds = [150, 250, 350]
+        # thresholds = [250, 350, 450] # for HappyFish.jpg
 
         fig, axes = plt.subplots(2, 3, figsize=(15, 10))
         
@@ -69,9 +175,11 @@ if __name__ == "__main__":
         axes[0, 2].set_ylabel('Frequency')
         axes[0, 2].grid(True, alpha=0.3)
         
-        # Apply edge detection with different thresholds
+        # Apply edge detection with different thresholds, all from the gradient above
+        edge_maps, edge_percentages = sobel_threshold_sweep(img, thresholds, grad_magnitude)
         for idx, thresh in enumerate(thresholds):
-            edge_map = sobel_edge_detector(img, thresh)
+            edge_map = edge_maps[thresh]
+            print(f"Threshold {thresh}: {edge_percentages[thresh]:.2f}% edge pixels")
             
             row = 1
             col = idx if idx < 3 else idx - 3
@@ -85,9 +193,11 @@ if __name__ == "__main__":
         plt.savefig('outputs/sobel_edge_detection_'+image_path.split('.')[0]+'.png', dpi=150, bbox_inches='tight')
         plt.show()
         
-        # Select optimal threshold (e.g., 50)
-        optimal_threshold = 8  # 12 for HappyFish.jpg, 8 for fruits.png
-        edge_map_final = sobel_edge_detector(img, optimal_threshold)
+        # Select optimal threshold: let the image pick it (Otsu, ~268 for fruits.png, ~375 for HappyFish.jpg)
+        optimal_threshold = round(auto_threshold(grad_magnitude, 'otsu'))
+        print(f"Automatic thresholds: otsu {auto_threshold(grad_magnitude, 'otsu'):.2f}, "
+              f"90th percentile {auto_threshold(grad_magnitude, 'percentile'):.2f}")
+        edge_map_final = sobel_edge_detector(img, optimal_threshold, grad_magnitude)
         
         # Display final result
         fig, axes = plt.subplots(1, 2, figsize=(12, 5))
@@ -0,0 +1,227 @@
+import numpy as np
+from utils import apply_convolution
+from median_filter import median_filter
+from calculate_gradient import calculate_gradient
+from calculate_histogram import HistogramAccumulator
+from equalize_histogram import equalization_lut, apply_equalization_lut
+
+# Side length of the square tiles read from disk, peak memory is a few of these (plus halo)
+DEFAULT_TILE_SIZE = 1024
+# Sobel kernels are 3x3
+GRADIENT_HALO = 1
+
+
+def convolution_halo(filter):
+    """Halo (extra border rows/columns) apply_convolution needs around a tile for this kernel."""
+    return max(np.shape(filter)) // 2
+
+
+def median_halo(size):
+    """Halo median_filter needs around a tile for a size x size window."""
+    return size // 2
+
+
+def iter_tiles(shape, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Split an image shape into tiles.
+    Args:
+        shape: (height, width)
+        tile_size: side length of a tile, border tiles are smaller
+    Returns:
+        generator of (y0, y1, x0, x1) tile bounds, end exclusive
+    """
+    img_h, img_w = shape[:2]
+    for y0 in range(0, img_h, tile_size):
+        for x0 in range(0, img_w, tile_size):
+            yield y0, min(y0 + tile_size, img_h), x0, min(x0 + tile_size, img_w)
+
+
+def open_output(out, shape, dtype):
+    """
+    Resolve an output argument of the tiled functions.
+    Args:
+        out: existing array (np.memmap, np.ndarray), path of a new .npy file, or None
+        shape: required shape
+        dtype: dtype of a newly created output
+    Returns:
+        output array; a path becomes a writable memmap (np.load(path, mmap_mode='r') reads it back)
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if isinstance(out, str):
+        return np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+    if out.shape != tuple(shape):
+        raise ValueError(f"Output has shape {out.shape}, expected {tuple(shape)}")
+    return out
+
+
+def process_tiled(src, op, halo, outputs, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Run a neighbourhood operation tile by tile over an image that may live on disk.
+    Every tile is read together with `halo` extra pixels on each side (clamped at
+    the image border), the operation runs on that block, and only the tile's own
+    pixels are written out. Inside the image the halo holds real neighbours; at the
+    image border the operation pads the block exactly as it would pad the whole
+    image, so every output pixel is computed from the same neighbourhood as on
+    the full image. That makes the result bit-identical for median, gradient,
+    histogram and the direct/separable convolution backends, and for uint8
+    convolution output. Kernels that apply_convolution sends to the FFT backend
+    (see choose_convolution_method) with clip=False differ by float round-off
+    (~1e-13 relative to 255), because the overlap-add block grid of a tile is
+    not the whole image's.
+    Only one tile (plus halo) and its results are in memory at a time.
+
+    Args:
+        src: 2D array-like, e.g. np.memmap or np.load(path, mmap_mode='r')
+        op: function of a 2D numpy array, returns an array or a tuple of arrays
+            of the same shape (e.g. calculate_gradient)
+        halo: footprint radius of op (kernel_size // 2)
+        outputs: array (or tuple of arrays, one per result of op) with src's shape
+        tile_size: side length of the tiles
+
+    Returns:
+        outputs, flushed to disk if they are memmaps
+    """
+    single_output = not isinstance(outputs, (tuple, list))
+    output_list = [outputs] if single_output else list(outputs)
+    img_h, img_w = src.shape
+
+    for y0, y1, x0, x1 in iter_tiles(src.shape, tile_size):
+        # Tile plus halo, clamped to the image
+        by0, by1 = max(0, y0 - halo), min(img_h, y1 + halo)
+        bx0, bx1 = max(0, x0 - halo), min(img_w, x1 + halo)
+        block = np.asarray(src[by0:by1, bx0:bx1])
+
+        results = op(block)
+        if single_output:
+            results = (results,)
+
+        for out, result in zip(output_list, results):
+            out[y0:y1, x0:x1] = result[y0-by0:y1-by0, x0-bx0:x1-bx0]
+
+    for out in output_list:
+        if isinstance(out, np.memmap):
+            out.flush()
+
+    return outputs
+
+
+def tiled_apply_convolution(src, filter, out=None, clip=True, tile_size=DEFAULT_TILE_SIZE):
+    """
+    apply_convolution over an on-disk image, see process_tiled.
+    Args:
+        src: 2D array-like (single channel)
+        filter: 2D numpy array (odd-sized kernel)
+        out: output array, path of a new .npy memmap, or None for an in-memory array
+        clip: as in apply_convolution (uint8 output if True, float64 otherwise)
+        tile_size: side length of the tiles
+    Returns:
+        filtered image
+    """
+    out = open_output(out, src.shape, np.uint8 if clip else np.float64)
+    return process_tiled(src, lambda block: apply_convolution(block, filter, clip=clip),
+                         convolution_halo(filter), out, tile_size)
+
+
+def tiled_median_filter(src, size=3, out=None, tile_size=DEFAULT_TILE_SIZE):
+    """
+    median_filter over an on-disk image, see process_tiled.
+    Args:
+        src: 2D array-like (grayscale image)
+        size: size of the filter window
+        out: output array, path of a new .npy memmap, or None for an in-memory array
+        tile_size: side length of the tiles
+    Returns:
+        filtered image, same dtype as src
+    """
+    out = open_output(out, src.shape, src.dtype)
+    return process_tiled(src, lambda block: median_filter(block, size),
+                         median_halo(size), out, tile_size)
+
+
+def tiled_calculate_gradient(src, magnitude_out=None, angle_out=None, tile_size=DEFAULT_TILE_SIZE):
+    """
+    calculate_gradient over an on-disk image, see process_tiled.
+    Args:
+        src: 2D array-like (grayscale image)
+        magnitude_out, angle_out: output arrays, paths of new .npy memmaps, or None
+        tile_size: side length of the tiles
+    Returns:
+        grad_magnitude, grad_angle (float32)
+    """
+    magnitude_out = open_output(magnitude_out, src.shape, np.float32)
+    angle_out = open_output(angle_out, src.shape, np.float32)
+    return process_tiled(src, calculate_gradient, GRADIENT_HALO,
+                         (magnitude_out, angle_out), tile_size)
+
+
+def tiled_histogram(src, bins, tile_size=DEFAULT_TILE_SIZE):
+    """
+    calculate_histogram over an on-disk image, one tile at a time.
+    Returns:
+        counts, dist as in calculate_histogram
+    """
+    accumulator = HistogramAccumulator(bins)
+    for y0, y1, x0, x1 in iter_tiles(src.shape, tile_size):
+        accumulator.add(np.asarray(src[y0:y1, x0:x1]))
+    return accumulator.counts, accumulator.dist
+
+
+def tiled_equalize_histogram(src, out=None, nbins=256, tile_size=DEFAULT_TILE_SIZE):
+    """
+    equalize_histogram over an on-disk uint8 image in two streaming passes:
+    histogram of every tile, then the LUT applied tile by tile.
+    Args:
+        src: 2D uint8 array-like
+        out: output array, path of a new .npy memmap, or None for an in-memory array
+        nbins: number of histogram bins
+        tile_size: side length of the tiles
+    Returns:
+        equalized image (uint8)
+    """
+    counts, dist = tiled_histogram(src, nbins, tile_size)
+    lut = equalization_lut(dist)
+    out = open_output(out, src.shape, np.uint8)
+    return process_tiled(src, lambda block: apply_equalization_lut(block, lut), 0, out, tile_size)
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+    import cv2
+    from utils import get_filters
+
+    # Build a large on-disk mosaic out of a bundled image
+    img = cv2.imread('images/fruits.png', cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        print("Error: Could not load image")
+    else:
+        repeats = 8
+        workdir = tempfile.mkdtemp()
+        mosaic_path = os.path.join(workdir, 'mosaic.npy')
+        mosaic = np.lib.format.open_memmap(mosaic_path, mode='w+', dtype=np.uint8,
+                                           shape=(img.shape[0] * repeats, img.shape[1] * repeats))
+        for i in range(repeats):
+            for j in range(repeats):
+                mosaic[i*img.shape[0]:(i+1)*img.shape[0], j*img.shape[1]:(j+1)*img.shape[1]] = img
+        mosaic.flush()
+        del mosaic
+
+        src = np.load(mosaic_path, mmap_mode='r')
+        print(f"Mosaic: {src.shape}, {src.nbytes / 1e6:.1f} MB on disk")
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        blurred = tiled_apply_convolution(src, get_filters()['gaussian'],
+                                          out=os.path.join(workdir, 'gaussian.npy'), tile_size=512)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Tiled gaussian: {elapsed:.2f} s, peak traced memory {peak / 1e6:.1f} MB")
+
+        # Tile seams must be invisible: compare a corner against the in-memory result
+        crop = np.asarray(src[:1500, :1500])
+        reference = apply_convolution(crop, get_filters()['gaussian'])
+        print(f"Matches in-memory result: {np.array_equal(blurred[:1499, :1499], reference[:1499, :1499])}")
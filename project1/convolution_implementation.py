@@ -2,43 +2,104 @@ import cv2
 import numpy as np
 import os
 
-def apply_convolution(image, filter):
+def apply_convolution(image, filter, clip=True):
     """
     Apply convolution to a single channel image using a square filter.
     Using zero-padding as boundary condition.
+    The sliding window is vectorized by shifting the padded image once per
+    kernel tap and accumulating the weighted shifts, so the Python loop runs
+    k*k times instead of once per pixel.
     Args:
         image: 2D numpy array (single channel)
         filter: 2D numpy array (square, odd-sized kernel)
+        clip: if True, clip to [0, 255] and cast to uint8,
+              if False, return the raw float64 response (negative values kept)
     Returns:
         Filtered image as 2D numpy array
     """
     # Get dimensions
-    img_height, img_width = image.shape
-    filter_size = filter.shape[0]
-    pad_size = filter_size // 2
-    
+    img_height, img_width = image.shape[-2:]
+    filter = np.asarray(filter, dtype=np.float64)
+    filter_h, filter_w = filter.shape
+    pad_h, pad_w = filter_h // 2, filter_w // 2
+
     # Create padded image (zero padding)
     # If kernel size = 5, pad size = 2
     # np.pad pads 2 pixels on each side i.e. top, bottom, left, right
-    padded_image = np.pad(image, pad_size, mode='constant', constant_values=0)
-    
-    # Initialize output image
-    output = np.zeros_like(image, dtype=np.float64)
-    
-    # Perform convolution
-    for i in range(img_height):
-        for j in range(img_width):
-            # Extract region of interest
-            region = padded_image[i:i+filter_size, j:j+filter_size]
-            # Apply filter (element-wise multiplication and sum)
-            output[i, j] = np.sum(region * filter)
-    
+    pad_width = [(0, 0)] * (image.ndim - 2) + [(pad_h, pad_h), (pad_w, pad_w)]
+    padded_image = np.pad(image.astype(np.float64, copy=False), pad_width,
+                          mode='constant', constant_values=0)
+
+    # Initialize output image and a scratch buffer reused by every tap
+    output = np.zeros(image.shape, dtype=np.float64)
+    weighted = np.empty_like(output)
+
+    # Perform convolution: output[i, j] = sum_(di, dj) filter[di, dj] * padded[i+di, j+dj]
+    # Every tap is one shifted view of the padded image, zero taps are skipped.
+    for di in range(filter_h):
+        for dj in range(filter_w):
+            weight = filter[di, dj]
+            if weight == 0:
+                continue
+            np.multiply(padded_image[..., di:di+img_height, dj:dj+img_width], weight, out=weighted)
+            output += weighted
+
+    if not clip:
+        return output
+
+    # Round away float round-off before truncating, e.g. nine taps of 1/9 over a flat
+    # region give 2.9999999999999996 instead of 3 and would be cast down to 2
+    np.round(output, 8, out=output)
+
     # Clip values to valid range
     output = np.clip(output, 0, 255)
     return output.astype(np.uint8)
 
 
 
+def separable_components(filter, tol=1e-10):
+    """
+    Split a kernel into column and row vectors if it is rank-1 (box, gaussian, sobel),
+    so it can run as two 1D passes (e.g. cv2.sepFilter2D).
+    Uses the SVD: a kernel is separable when all singular values but the first vanish.
+    Same test and tolerance as image_processing/utils.get_separable_components (project1
+    stays importable on its own, like apply_convolution and get_filters above), so a
+    kernel takes the separable path in the webcam app exactly when it does in the library.
+    Args:
+        filter: 2D numpy array
+        tol: relative tolerance on the second singular value
+    Returns:
+        (column, row) with outer(column, row) == filter, or None if not separable
+    """
+    filter = np.asarray(filter, dtype=np.float64)
+    u, s, vt = np.linalg.svd(filter)
+    if s[0] == 0 or (len(s) > 1 and s[1] > tol * s[0]):
+        return None
+
+    column = u[:, 0]
+    row = vt[0] * s[0]
+    # Rescale so the smallest nonzero column entry is 1 (largest entry positive), which
+    # gives integer kernels integer factors, e.g. sobel_vertical = [1, 2, 1] x [-1, 0, 1]
+    magnitudes = np.abs(column)
+    scale = np.min(magnitudes[magnitudes > tol * magnitudes.max()])
+    scale *= np.sign(column[np.argmax(magnitudes)])
+    return clean_factor(column / scale, tol), clean_factor(row * scale, tol)
+
+
+def clean_factor(vector, tol=1e-10):
+    """
+    Remove SVD round-off from a separable factor, as image_processing/utils.clean_factor:
+    entries below tol * max|entry| become exactly 0, entries within tol * max|entry|
+    of an integer are rounded to it.
+    """
+    scale = np.max(np.abs(vector))
+    if scale == 0:
+        return vector
+    vector = np.where(np.abs(vector) < tol * scale, 0.0, vector)
+    rounded = np.round(vector)
+    return np.where(np.abs(vector - rounded) <= tol * scale, rounded, vector)
+
+
 def get_filters():
     return {
         'box': np.ones((3, 3)) / 9,
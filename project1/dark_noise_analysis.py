@@ -1,12 +1,19 @@
 import os
+import json
 import argparse
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 import rawpy
 import numpy as np
 import matplotlib.pyplot as plt
+from raw_cache import load_raw_cached
 
-def load_raw_as_2d(path):
+def load_raw_as_2d(path, use_cache=True):
     """Load DNG and return single-channel 2D raw sensor array (float32)."""
+    if use_cache:
+        # Decoded once into ./outputs/raw_cache, later runs read the uint16 .npy back
+        raw_image, _ = load_raw_cached(path)
+        return raw_image.astype(np.float32)
     with rawpy.imread(path) as raw:
         # raw.raw_image is the sensor data (2D). Cast to float for numeric ops.
         arr = raw.raw_image.astype(np.float32)
@@ -22,17 +29,36 @@ def load_raw_as_2d(path):
         #     pass
         return arr
 
-def center_patch(arr, patch_size=100):
-    """Return center patch (square) of patch_size x patch_size from 2D array."""
-    h, w = arr.shape
+def center_patch_bounds(shape, patch_size=100):
+    """Return (y0, y1, x0, x1) of the center patch (square) of patch_size x patch_size."""
+    h, w = shape
     ps = int(patch_size)
     cy, cx = h // 2, w // 2
     y0 = max(0, cy - ps // 2)
     x0 = max(0, cx - ps // 2)
     y1 = min(h, y0 + ps)
     x1 = min(w, x0 + ps)
+    return y0, y1, x0, x1
+
+def center_patch(arr, patch_size=100):
+    """Return center patch (square) of patch_size x patch_size from 2D array."""
+    y0, y1, x0, x1 = center_patch_bounds(arr.shape, patch_size)
     return arr[y0:y1, x0:x1]
 
+def center_patch_stats(arr, patch_size=100, integral=None):
+    """
+    Mean and sample std (ddof=1) of the center patch.
+    With integral=IntegralImage(arr) the patch is answered from the summed-area
+    tables instead of being reduced, useful when the same frame is queried for
+    several patch sizes.
+    """
+    if integral is None:
+        patch = center_patch(arr, patch_size)
+        return float(np.mean(patch)), float(np.std(patch, ddof=1))
+    y0, y1, x0, x1 = center_patch_bounds(arr.shape, patch_size)
+    stats = integral.region_stats(x0, y0, x1, y1, ddof=1)
+    return float(stats['mean']), float(stats['std'])
+
 def analyze_file(path, patch_size=100, bins=200, hist_range=None, outdir="./outputs/out_hist"):
     os.makedirs(outdir, exist_ok=True)
     arr = load_raw_as_2d(path)
@@ -41,8 +67,7 @@ def analyze_file(path, patch_size=100, bins=200, hist_range=None, outdir="./outp
     print(f"  min: {float(arr.min()):.3f}, max: {float(arr.max()):.3f}")
 
     patch = center_patch(arr, patch_size=patch_size)
-    mu = float(np.mean(patch))
-    sigma = float(np.std(patch, ddof=1))
+    mu, sigma = center_patch_stats(arr, patch_size=patch_size)
     print(f"  patch (size {patch.shape}) mean: {mu:.3f}, std: {sigma:.3f}")
 
     # Histogram of the patch (more detail where noise lives)
@@ -73,15 +98,179 @@ def analyze_file(path, patch_size=100, bins=200, hist_range=None, outdir="./outp
         "hist_range": (hist_min, hist_max)
     }
 
+class WelfordAccumulator:
+    """
+    Running per-pixel mean and variance of a stack of frames (Welford's algorithm),
+    one frame at a time, so the stack never has to be held in memory.
+    Accumulators built on different workers are combined with merge().
+    """
+    def __init__(self, shape=None):
+        self.count = 0
+        self.mean = None if shape is None else np.zeros(shape, dtype=np.float64)
+        self.m2 = None if shape is None else np.zeros(shape, dtype=np.float64)  # sum of squared deviations
+
+    def add(self, frame):
+        """Fold one 2D frame into the running statistics."""
+        if self.mean is None:
+            self.mean = np.zeros(frame.shape, dtype=np.float64)
+            self.m2 = np.zeros(frame.shape, dtype=np.float64)
+        if frame.shape != self.mean.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match the stack {self.mean.shape}")
+        self.count += 1
+        delta = frame - self.mean
+        self.mean += delta / self.count
+        # delta * (x - new mean), written in place into delta
+        delta *= frame - self.mean
+        self.m2 += delta
+        return self
+
+    def merge(self, other):
+        """Combine with another accumulator (Chan et al. parallel update)."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return self
+        if other.mean.shape != self.mean.shape:
+            raise ValueError(f"Frame shape {other.mean.shape} does not match the stack {self.mean.shape}")
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / count)
+        self.m2 += other.m2 + delta * delta * (self.count * other.count / count)
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        """Per-pixel sample variance (ddof=1), needs at least two frames."""
+        if self.count < 2:
+            raise ValueError("Need at least two frames for a variance")
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+def summarize_frame(path, arr, patch_size=100):
+    """Per-file summary statistics of a decoded frame."""
+    mu, sigma = center_patch_stats(arr, patch_size=patch_size)
+    return {
+        "file": path,
+        "shape": list(arr.shape),
+        "min": float(arr.min()),
+        "max": float(arr.max()),
+        "frame_mean": float(np.mean(arr, dtype=np.float64)),
+        "frame_std": float(np.std(arr, dtype=np.float64)),
+        "patch_mean": mu,
+        "patch_std": sigma,
+    }
+
+
+def accumulate_files(paths, patch_size=100):
+    """
+    Decode DNGs one at a time into a WelfordAccumulator (runs in a worker process).
+    Returns:
+        accumulator, list of per-file summaries (unreadable files get an 'error' entry)
+    """
+    accumulator = WelfordAccumulator()
+    summaries = []
+    for path in paths:
+        try:
+            # uint16 memmap straight from the decode cache, no float32 copy of the frame
+            arr, _ = load_raw_cached(path)
+            accumulator.add(arr)
+            summaries.append(summarize_frame(path, arr, patch_size))
+        except Exception as e:
+            summaries.append({"file": path, "error": str(e)})
+    return accumulator, summaries
+
+
+def analyze_stack(paths, patch_size=100, workers=None):
+    """
+    Master dark frame and temporal noise map of a stack of dark frames.
+    The paths are dealt round-robin to a process pool; every worker decodes its
+    files one after another into its own Welford accumulator, and the partial
+    accumulators are merged at the end. Memory per worker is two float64 frames
+    plus the frame being decoded, whatever the number of files.
+
+    Args:
+        paths: list of DNG paths (same sensor, same shape)
+        patch_size: size of the center patch in the per-file summaries
+        workers: number of processes, defaults to os.cpu_count()
+
+    Returns:
+        master_dark: per-pixel mean (float64)
+        noise_map: per-pixel temporal std, ddof=1 (float64)
+        summaries: per-file summary dicts in the order of paths
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    chunks = [paths[i::workers] for i in range(workers)]
+
+    accumulator = WelfordAccumulator()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial_accumulator, chunk_summaries in executor.map(accumulate_files, chunks,
+                                                                 [patch_size] * workers):
+            accumulator.merge(partial_accumulator)
+            summaries.extend(chunk_summaries)
+
+    order = {path: i for i, path in enumerate(paths)}
+    summaries.sort(key=lambda r: order[r["file"]])
+    if accumulator.count < 2:
+        raise ValueError(f"Need at least two readable frames, got {accumulator.count}")
+    return accumulator.mean, accumulator.std, summaries
+
+
+def run_stack_mode(pattern, patch_size, workers, outdir):
+    """Batch mode: analyze every DNG matching a glob and save the results."""
+    paths = sorted(glob(pattern))
+    if not paths:
+        print(f"No files match {pattern}")
+        return
+    print(f"Analyzing {len(paths)} frames with {workers or os.cpu_count()} workers")
+
+    master_dark, noise_map, summaries = analyze_stack(paths, patch_size, workers)
+
+    os.makedirs(outdir, exist_ok=True)
+    np.save(os.path.join(outdir, "master_dark.npy"), master_dark.astype(np.float32))
+    np.save(os.path.join(outdir, "noise_map.npy"), noise_map.astype(np.float32))
+    with open(os.path.join(outdir, "frame_summaries.json"), "w") as f:
+        json.dump(summaries, f, indent=2)
+
+    print("Summary:")
+    for r in summaries:
+        if "error" in r:
+            print(f"- {os.path.basename(r['file'])}: error: {r['error']}")
+        else:
+            print(f"- {os.path.basename(r['file'])}: patch mean={r['patch_mean']:.3f}, std={r['patch_std']:.3f}")
+    print(f"Master dark: mean={master_dark.mean():.3f}, temporal noise: median={np.median(noise_map):.3f}, "
+          f"mean={noise_map.mean():.3f}")
+    print(f"Saved master_dark.npy, noise_map.npy and frame_summaries.json to {outdir}")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Dark frame noise analysis")
+    parser.add_argument("--glob", dest="pattern",
+                        help="batch mode: analyze every DNG matching this pattern, e.g. './images/dark_*.dng'")
+    parser.add_argument("--workers", type=int, help="decoder processes in batch mode (default: all cores)")
+    parser.add_argument("--patch-size", type=int, default=100, help="side of the center patch")
+    parser.add_argument("--bins", type=int, default=200, help="histogram bins")
+    parser.add_argument("--outdir", help="output directory")
+    args = parser.parse_args()
+
+    if args.pattern:
+        run_stack_mode(args.pattern, args.patch_size, args.workers, args.outdir or "./outputs/dark_stack")
+        return
+
     paths = [
         "./images/dark_1.dng",
         "./images/dark_2.dng",
         "./images/dark_3.dng",
     ]
-    out_path = "./outputs/out_hist"
-    no_of_bins = 200
-    patch_size = 100
+    out_path = args.outdir or "./outputs/out_hist"
+    no_of_bins = args.bins
+    patch_size = args.patch_size
 
     results = []
     for p in paths:
@@ -0,0 +1,163 @@
+import cv2
+import numpy as np
+from convolution_implementation import get_filters, separable_components
+
+# Step kinds a chain accepts, with the parameter each one takes
+STEP_KINDS = {
+    'kernel': 'name of a get_filters() kernel',
+    'median': 'odd window size',
+    'equalize': None,
+    'sobel': 'gradient magnitude threshold',
+}
+
+
+def prepare_filter(name, filters):
+    """
+    Precompute everything needed to run a get_filters() kernel, once per chain.
+    Returns:
+        dict with 'gray' (filter one grayscale channel instead of three BGR ones),
+        'kernel' (float32) and, for rank-1 kernels, 'column'/'row' float32 vectors for sepFilter2D
+    """
+    kernel = np.asarray(filters[name], dtype=np.float64)
+    prepared = {
+        'gray': 'sobel' in name or 'emboss' in name,
+        'kernel': kernel.astype(np.float32),
+        'column': None,
+        'row': None,
+    }
+    components = separable_components(kernel)
+    if components is not None:
+        column, row = components
+        prepared['column'] = column.astype(np.float32)
+        prepared['row'] = row.astype(np.float32)
+    return prepared
+
+
+def apply_prepared_filter(prepared, src, dst):
+    """Filter src into dst (same shape, uint8) with a prepare_filter() kernel."""
+    if prepared['row'] is not None:
+        # Two 1D passes: 2k taps per pixel instead of k*k
+        cv2.sepFilter2D(src, -1, prepared['row'], prepared['column'], dst=dst)
+    else:
+        cv2.filter2D(src, -1, prepared['kernel'], dst=dst)
+
+
+class FilterChain:
+    """
+    Ordered chain of frame operations, e.g.
+        FilterChain([('kernel', 'gaussian'), ('median', 5), ('sobel', 100)])
+    Steps: ('kernel', name), ('median', size), ('equalize',), ('sobel', threshold).
+
+    A chain is immutable once built: to change the processing, build a new chain
+    and assign it in one statement; a frame in flight finishes with the chain it
+    started with. Kernels are prepared when the chain is built and intermediate
+    buffers are allocated on the first frame, then reused for every frame of
+    that size. If any step needs a single channel (equalize, sobel, the sobel
+    and emboss kernels) the whole chain runs on the grayscale frame.
+    """
+    def __init__(self, steps, filters=None):
+        filters = filters or get_filters()
+        self.steps = tuple(tuple(step) if isinstance(step, (tuple, list)) else (step,) for step in steps)
+        self.prepared = []
+        for step in self.steps:
+            kind = step[0]
+            if kind not in STEP_KINDS:
+                raise ValueError(f"Unknown step: {kind}")
+            if kind == 'kernel':
+                if step[1] not in filters:
+                    raise ValueError(f"Unknown filter: {step[1]}")
+                self.prepared.append(prepare_filter(step[1], filters))
+            elif kind == 'median':
+                if int(step[1]) % 2 == 0:
+                    raise ValueError("Median size must be odd")
+                self.prepared.append(int(step[1]))
+            elif kind == 'sobel':
+                self.prepared.append(float(step[1]))
+            else:
+                self.prepared.append(None)
+        self.gray = any(step[0] in ('equalize', 'sobel') or (step[0] == 'kernel' and prepared['gray'])
+                        for step, prepared in zip(self.steps, self.prepared))
+        self.buffers = {}
+
+    def describe(self):
+        """Short name of the chain, e.g. 'gaussian+median5+sobel100' (used in file names)."""
+        parts = []
+        for step in self.steps:
+            if step[0] == 'kernel':
+                parts.append(step[1])
+            elif len(step) > 1:
+                parts.append(f"{step[0]}{step[1]:g}" if isinstance(step[1], float) else f"{step[0]}{step[1]}")
+            else:
+                parts.append(step[0])
+        return '+'.join(parts) or 'identity'
+
+    def buffer(self, key, shape, dtype=np.uint8):
+        """Intermediate buffer reused across frames, reallocated only when the frame size changes."""
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self.buffers[key] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def apply(self, img, dst):
+        """
+        Run the chain on a BGR frame.
+        Args:
+            img: (h, w, 3) uint8 BGR frame
+            dst: (h, w, 3) uint8 array (e.g. a view into the output ring) to write the result into
+        Returns:
+            dst
+        """
+        if not self.steps:
+            np.copyto(dst, img)
+            return dst
+
+        if self.gray:
+            current = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self.buffer('gray', img.shape[:2]))
+        else:
+            current = img
+        shape = current.shape
+        ping_pong = (self.buffer('a', shape), self.buffer('b', shape))
+
+        for i, (step, prepared) in enumerate(zip(self.steps, self.prepared)):
+            # The last colour step writes straight into dst
+            last = i == len(self.steps) - 1
+            out = dst if last and not self.gray else ping_pong[i % 2]
+            kind = step[0]
+            if kind == 'kernel':
+                apply_prepared_filter(prepared, current, out)
+            elif kind == 'median':
+                cv2.medianBlur(current, prepared, dst=out)
+            elif kind == 'equalize':
+                cv2.equalizeHist(current, dst=out)
+            elif kind == 'sobel':
+                gx = cv2.Sobel(current, cv2.CV_32F, 1, 0, ksize=3, dst=self.buffer('gx', shape, np.float32))
+                gy = cv2.Sobel(current, cv2.CV_32F, 0, 1, ksize=3, dst=self.buffer('gy', shape, np.float32))
+                magnitude = cv2.magnitude(gx, gy, self.buffer('magnitude', shape, np.float32))
+                # 255 where magnitude > threshold, 0 elsewhere
+                cv2.compare(magnitude, prepared, cv2.CMP_GT, dst=out)
+            current = out
+
+        if self.gray:
+            cv2.cvtColor(current, cv2.COLOR_GRAY2BGR, dst=dst)
+        return dst
+
+
+if __name__ == "__main__":
+    import time
+
+    img = cv2.imread("./images/bright_blobs.png")
+    if img is None:
+        print("Error: Could not read ./images/bright_blobs.png")
+    else:
+        chains = [
+            FilterChain([('kernel', 'gaussian')]),
+            FilterChain([('kernel', 'gaussian'), ('median', 5), ('equalize',)]),
+            FilterChain([('median', 5), ('sobel', 100)]),
+        ]
+        out = np.empty_like(img)
+        for chain in chains:
+            chain.apply(img, out)
+            start = time.perf_counter()
+            for _ in range(50):
+                chain.apply(img, out)
+            print(f"{chain.describe()}: {(time.perf_counter() - start) / 50 * 1000:.2f} ms per frame")
@@ -2,20 +2,33 @@ import numpy as np
 import rawpy
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
+from raw_cache import load_raw_cached
+from patch_finder import find_uniform_patches
 
 
-def load_raw_as_2d(path):
+def load_raw_as_2d(path, use_cache=True):
     """
     Load DNG and return single-channel 2D raw sensor array (float32).
     This preserves the original Bayer pattern without demosaicing.
     
     Args:
         path: Path to the DNG file
+        use_cache: read the decoded frame from ./outputs/raw_cache (see raw_cache.py)
         
     Returns:
         arr: 2D numpy array of raw sensor values (float32)
     """
     print(f"\nLoading raw image: {path}")
+    if use_cache:
+        raw_image, metadata = load_raw_cached(path)
+        arr = raw_image.astype(np.float32)
+        bl = np.mean(metadata['black_level_per_channel'])
+        print(f"  Black level: {bl:.2f}")
+        arr -= bl
+        print(f"  Image shape: {arr.shape}")
+        print(f"  Value range: [{arr.min():.2f}, {arr.max():.2f}]")
+        return arr
+
     with rawpy.imread(path) as raw:
         # raw.raw_image is the sensor data (2D). Cast to float for numeric ops.
         arr = raw.raw_image.astype(np.float32)
@@ -85,7 +98,7 @@ def get_selected_region(coords):
         return None
 
 
-def calculate_noise_stats_2d(image, region_coords):
+def calculate_noise_stats_2d(image, region_coords, integral=None):
     """
     Calculate mean and standard deviation for a selected region.
     Works with 2D raw sensor data (single channel).
@@ -93,12 +106,28 @@ def calculate_noise_stats_2d(image, region_coords):
     Args:
         image: 2D numpy array of raw sensor values
         region_coords: Dictionary with 'x1', 'y1', 'x2', 'y2'
+        integral: optional IntegralImage(image), answers the region in O(1)
+                  instead of reducing it (worth it when many regions are queried)
         
     Returns:
         stats: Dictionary containing mean and std
     """
     x1, y1 = region_coords['x1'], region_coords['y1']
     x2, y2 = region_coords['x2'], region_coords['y2']
+
+    if integral is not None:
+        region_stats = integral.region_stats(x1, y1, x2, y2)
+        # Same dtype as np.mean / np.std of the region: float32 stays float32, integers give float64
+        dtype = image.dtype.type if np.issubdtype(image.dtype, np.floating) else np.float64
+        mean_val, std_val = dtype(region_stats['mean']), dtype(region_stats['std'])
+        h, w = image.shape
+        return {
+            'mean': mean_val,
+            'std': std_val,
+            'snr': mean_val / std_val if std_val > 0 else float('inf'),
+            'region_size': (min(y2, h) - min(y1, h), min(x2, w) - min(x1, w)),
+            'num_pixels': int(region_stats['num_pixels'])
+        }
     
     # Extract region (note: image indexing is [y, x])
     region = image[y1:y2, x1:x2]
@@ -118,6 +147,109 @@ def calculate_noise_stats_2d(image, region_coords):
     return stats
 
 
+def cfa_channel_names(raw_pattern, color_desc="RGBG"):
+    """
+    Names of the 2x2 CFA positions, e.g. [['R', 'G1'], ['G2', 'B']] for RGGB.
+    The two green sites get their own names because they are read out separately.
+    
+    Args:
+        raw_pattern: 2x2 channel indices into color_desc (rawpy's raw.raw_pattern)
+        color_desc: channel letters (rawpy's raw.color_desc), usually 'RGBG'
+        
+    Returns:
+        names: 2x2 list of channel names
+    """
+    names = [[color_desc[int(raw_pattern[a][b])] for b in range(2)] for a in range(2)]
+    flat = [n for row in names for n in row]
+    if flat.count('G') == 2:
+        greens = iter(['G1', 'G2'])
+        names = [[next(greens) if n == 'G' else n for n in row] for row in names]
+    return names
+
+
+def calculate_cfa_noise_stats(raw_image, region_coords, raw_pattern, black_level_per_channel,
+                              color_desc="RGBG"):
+    """
+    Per-CFA-channel mean, std and SNR of a region of the Bayer mosaic, each
+    channel corrected with its own black level.
+    The region is viewed as (rows/2, 2, cols/2, 2) without copying, so [:, a, :, b]
+    is the strided sub-mosaic of CFA position (a, b); sums and sums of squares of all
+    four positions come out of one einsum pass each, accumulated in float64.
+    
+    Args:
+        raw_image: 2D raw sensor values, before black-level subtraction
+                   (e.g. the uint16 memmap of load_raw_cached)
+        region_coords: Dictionary with 'x1', 'y1', 'x2', 'y2'; an odd-sized
+                       region loses its last row/column
+        raw_pattern: 2x2 channel indices of the CFA tile at the image origin
+        black_level_per_channel: black level of every channel index
+        color_desc: channel letters, see cfa_channel_names
+        
+    Returns:
+        stats: Dictionary channel name -> dict with mean, std, snr, black_level, num_pixels
+    """
+    x1, y1 = region_coords['x1'], region_coords['y1']
+    x2, y2 = region_coords['x2'], region_coords['y2']
+    y2 = y1 + (y2 - y1) // 2 * 2
+    x2 = x1 + (x2 - x1) // 2 * 2
+    
+    region = raw_image[y1:y2, x1:x2]
+    h, w = region.shape
+    # Splitting both axes in two is a pure stride change, no copy
+    tiles = region.reshape(h // 2, 2, w // 2, 2)
+    
+    sums = np.einsum('iajb->ab', tiles, dtype=np.float64)
+    sq_sums = np.einsum('iajb,iajb->ab', tiles, tiles, dtype=np.float64)
+    n = (h // 2) * (w // 2)
+    raw_mean = sums / n
+    std = np.sqrt(np.maximum(sq_sums / n - raw_mean ** 2, 0))
+    
+    names = cfa_channel_names(raw_pattern, color_desc)
+    stats = {}
+    for a in range(2):
+        for b in range(2):
+            # CFA position of region pixel (a, b) in the full image
+            pa, pb = (y1 + a) % 2, (x1 + b) % 2
+            channel = int(raw_pattern[pa][pb])
+            black_level = float(black_level_per_channel[channel])
+            mean_val = raw_mean[a, b] - black_level
+            std_val = std[a, b]
+            stats[names[pa][pb]] = {
+                'mean': mean_val,
+                'std': std_val,
+                'snr': mean_val / std_val if std_val > 0 else float('inf'),
+                'black_level': black_level,
+                'num_pixels': n
+            }
+    
+    return stats
+
+
+def print_cfa_results(camera_name, cfa_stats):
+    """Print per-CFA-channel noise statistics."""
+    print(f"\n{camera_name} per-CFA-channel noise (black level per channel)")
+    print(f"{'-'*60}")
+    print(f"{'Channel':<8} {'Black':>8} {'Mean (μ)':>12} {'Std (σ)':>10} {'SNR':>8}")
+    for name, s in cfa_stats.items():
+        print(f"{name:<8} {s['black_level']:>8.1f} {s['mean']:>12.2f} {s['std']:>10.4f} {s['snr']:>8.2f}")
+
+
+def find_uniform_patch_coords(image, patch_size=100):
+    """
+    Coordinates of the most uniform patch of an image, as [(x1, y1), (x2, y2)].
+    Searches the mid-intensity level so the patch is neither clipped nor in the dark.
+    The image is the full Bayer mosaic: align=2 keeps the step and patch size even,
+    so every candidate window covers the same CFA phase.
+    """
+    patches = find_uniform_patches(image, patch_size=patch_size, top_k=1, n_levels=3, align=2)
+    middle = [p for p in patches if p['level'] == 1] or patches
+    if not middle:
+        return []
+    best = middle[0]
+    print(f"  Uniform patch found at ({best['x1']}, {best['y1']}), std {best['std']:.2f}")
+    return [(best['x1'], best['y1']), (best['x2'], best['y2'])]
+
+
 def print_results(camera_name, fov, stats):
     """Print analysis results in a formatted way."""
     print(f"\n{'='*60}")
@@ -228,6 +360,7 @@ def main():
     # UNIFORM REGION COORDINATES
     # ========================================================================
     # Format: [(x1, y1), (x2, y2)] - top-left and bottom-right corners
+    # Set to None to pick the most uniform 100x100 patch automatically (patch_finder.py)
     main_image_uniform_patch_coord = [(1373, 1599), (1476, 1672)]
     ultrawide_image_uniform_patch_coord = [(1414, 1446), (1522, 1512)]
 
@@ -270,6 +403,8 @@ def main():
     print("STEP 3: NOISE ANALYSIS - MAIN CAMERA")
     print("="*60)
     
+    if main_image_uniform_patch_coord is None:
+        main_image_uniform_patch_coord = find_uniform_patch_coords(main_image)
     main_region = get_selected_region(main_image_uniform_patch_coord)
     
     if main_region is None:
@@ -278,6 +413,12 @@ def main():
     
     main_stats = calculate_noise_stats_2d(main_image, main_region)
     print_results("MAIN", main_fov, main_stats)
+
+    # Same region per CFA channel, from the cached uint16 mosaic
+    main_raw, main_meta = load_raw_cached(MAIN_IMAGE_PATH)
+    print_cfa_results("MAIN", calculate_cfa_noise_stats(
+        main_raw, main_region, main_meta['raw_pattern'], main_meta['black_level_per_channel'],
+        main_meta['color_desc']))
     
     # Optional: Visualize the selected region
     # visualize_region_selection(main_image, main_region, "Main Camera - Selected Region")
@@ -289,6 +430,8 @@ def main():
     print("STEP 4: NOISE ANALYSIS - ULTRAWIDE CAMERA")
     print("="*60)
     
+    if ultrawide_image_uniform_patch_coord is None:
+        ultrawide_image_uniform_patch_coord = find_uniform_patch_coords(ultrawide_image)
     ultrawide_region = get_selected_region(ultrawide_image_uniform_patch_coord)
     
     if ultrawide_region is None:
@@ -297,6 +440,11 @@ def main():
     
     ultrawide_stats = calculate_noise_stats_2d(ultrawide_image, ultrawide_region)
     print_results("ULTRAWIDE", ultrawide_fov, ultrawide_stats)
+
+    ultrawide_raw, ultrawide_meta = load_raw_cached(ULTRAWIDE_IMAGE_PATH)
+    print_cfa_results("ULTRAWIDE", calculate_cfa_noise_stats(
+        ultrawide_raw, ultrawide_region, ultrawide_meta['raw_pattern'],
+        ultrawide_meta['black_level_per_channel'], ultrawide_meta['color_desc']))
     
     # Optional: Visualize the selected region
     # visualize_region_selection(ultrawide_image, ultrawide_region, 
@@ -0,0 +1,157 @@
+import numpy as np
+
+
+def block_sums(arr, step):
+    """
+    Sums and sums of squares of non-overlapping step x step blocks (float64).
+    The array is viewed as (rows/step, step, cols/step, step) without copying and
+    reduced with einsum; trailing rows/columns that don't fill a block are ignored.
+
+    Args:
+        arr: 2D numpy array (e.g. uint16 raw memmap or float32 frame)
+        step: block side
+
+    Returns:
+        sums, sq_sums: (rows // step, cols // step) float64 arrays
+    """
+    h, w = arr.shape
+    hb, wb = h // step, w // step
+    blocks = arr[:hb * step, :wb * step].reshape(hb, step, wb, step)
+    sums = np.einsum('iajb->ij', blocks, dtype=np.float64)
+    sq_sums = np.einsum('iajb,iajb->ij', blocks, blocks, dtype=np.float64)
+    return sums, sq_sums
+
+
+def default_step(patch_size, align=1):
+    """
+    Largest multiple of align that divides patch_size and is at most patch_size // 4
+    (25 for 100, 20 for 100 on a Bayer mosaic with align=2), so windows are whole blocks.
+    """
+    for step in range(max(align, patch_size // 4 // align * align), 0, -align):
+        if patch_size % step == 0:
+            return step
+    return align
+
+
+def local_mean_std(arr, patch_size=100, step=None, align=1):
+    """
+    Mean and std of every patch_size x patch_size window whose corner lies on a
+    grid of `step` pixels, from box sums: the frame is reduced to step x step
+    block sums once, then every window is a sum of (patch_size / step)^2 blocks
+    read from a summed-area table of the block grid in O(1).
+
+    Args:
+        arr: 2D numpy array
+        patch_size: window side, a multiple of step (and of align)
+        step: grid spacing of the window corners, defaults to default_step(patch_size, align);
+              step=1 gives the exact sliding-window map (slower on large frames)
+        align: step and patch_size must be multiples of it, 2 for a Bayer mosaic
+               so every window starts on the same CFA phase
+
+    Returns:
+        mean, std: (n_rows, n_cols) maps, entry [i, j] is the window with top-left
+                   corner (y, x) = (i * step, j * step)
+        step, window: the grid spacing and the window side used (= patch_size)
+    """
+    if patch_size < 1 or patch_size % align:
+        raise ValueError(f"patch_size {patch_size} must be a positive multiple of align={align}")
+    step = step or default_step(patch_size, align)
+    if step % align or patch_size % step:
+        raise ValueError(f"step {step} must be a multiple of align={align} and divide patch_size {patch_size}")
+    k = patch_size // step  # window side in blocks
+    sums, sq_sums = block_sums(arr, step)
+
+    def window_sums(values):
+        S = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+        np.cumsum(values, axis=0, out=S[1:, 1:])
+        np.cumsum(S[1:, 1:], axis=1, out=S[1:, 1:])
+        return S[k:, k:] - S[:-k, k:] - S[k:, :-k] + S[:-k, :-k]
+
+    n = float((k * step) ** 2)
+    mean = window_sums(sums) / n
+    var = window_sums(sq_sums) / n - mean * mean
+    std = np.sqrt(np.maximum(var, 0))
+    return mean, std, step, k * step
+
+
+def find_uniform_patches(arr, patch_size=100, top_k=3, n_levels=5, step=None, mean_range=None, align=1):
+    """
+    Most uniform patches of a frame across a range of intensity levels.
+    Window means are split into n_levels equal-width intensity bands; in every
+    band the windows with the lowest std are taken greedily, skipping any that
+    overlap a patch already chosen, so each band yields top_k distinct patches.
+
+    For a Bayer mosaic, pass one CFA channel (e.g. raw[0::2, 1::2], a view) or
+    align=2 so the colour sites don't differ between windows.
+
+    Args:
+        arr: 2D numpy array (raw frame, black-level corrected or not)
+        patch_size: side of the patches
+        top_k: patches per intensity level
+        n_levels: number of intensity levels
+        step: grid spacing of candidate corners, see local_mean_std
+        align: 2 for a full Bayer mosaic (even step and patch_size), see local_mean_std
+        mean_range: (low, high) intensity range to search, defaults to the
+                    1st..99th percentile of the window means
+
+    Returns:
+        patches: list of dicts with 'x1', 'y1', 'x2', 'y2' (same convention as
+                 get_selected_region, usable with calculate_noise_stats_2d),
+                 'mean', 'std' and 'level', sorted by level then std
+    """
+    mean, std, step, window = local_mean_std(arr, patch_size, step, align)
+    if mean.size == 0:
+        return []
+
+    if mean_range is None:
+        mean_range = np.percentile(mean, [1, 99])
+    level_edges = np.linspace(mean_range[0], mean_range[1], n_levels + 1)
+    levels = np.searchsorted(level_edges, mean.ravel(), side='right') - 1
+    flat_std = std.ravel()
+    n_cols = mean.shape[1]
+    # Windows closer than this many grid steps overlap
+    min_gap = -(-window // step)
+
+    patches = []
+    for level in range(n_levels):
+        candidates = np.flatnonzero(levels == level)
+        if candidates.size == 0:
+            continue
+        # Only the least noisy candidates can be picked, sort just those
+        limit = min(candidates.size, 64 * top_k)
+        best = candidates[np.argpartition(flat_std[candidates], limit - 1)[:limit]]
+        best = best[np.argsort(flat_std[best], kind='stable')]
+
+        chosen = []
+        for idx in best:
+            i, j = divmod(int(idx), n_cols)
+            if all(abs(i - ci) >= min_gap or abs(j - cj) >= min_gap for ci, cj in chosen):
+                chosen.append((i, j))
+                y, x = i * step, j * step
+                patches.append({
+                    'x1': x, 'y1': y, 'x2': x + window, 'y2': y + window,
+                    'mean': float(mean[i, j]), 'std': float(std[i, j]), 'level': level
+                })
+                if len(chosen) == top_k:
+                    break
+
+    return patches
+
+
+if __name__ == "__main__":
+    import time
+
+    # Synthetic 12 MP frame: smooth intensity ramp, textured stripes and read noise
+    rng = np.random.default_rng(0)
+    h, w = 3000, 4000
+    yy, xx = np.mgrid[0:h, 0:w]
+    frame = 200 + 800 * xx / w + 40 * np.sin(yy / 7.0) * (yy % 600 < 200)
+    frame = (frame + rng.normal(0, 3, size=(h, w))).astype(np.uint16)
+
+    start = time.perf_counter()
+    patches = find_uniform_patches(frame, patch_size=100, top_k=2, n_levels=5)
+    print(f"Searched {h}x{w} in {time.perf_counter() - start:.3f} s")
+    for p in patches:
+        region = frame[p['y1']:p['y2'], p['x1']:p['x2']]
+        print(f"level {p['level']}: ({p['x1']},{p['y1']})-({p['x2']},{p['y2']}) "
+              f"mean {p['mean']:.1f} std {p['std']:.2f} (direct: {region.mean():.1f}, {region.std():.2f})")
@@ -0,0 +1,198 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# Decoded frames live next to the other outputs, ignored by git
+RAW_CACHE_DIR = "./outputs/raw_cache"
+# Size cap of the cache, least recently used entries are evicted past it
+# (a 12 MP frame is ~24 MB, so this holds ~80 frames)
+RAW_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def cache_key(path):
+    """
+    Cache key of a raw file: absolute path, size and modification time, so an
+    edited or replaced DNG is decoded again.
+    """
+    st = os.stat(path)
+    ident = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+
+def cache_paths(path, cache_dir=RAW_CACHE_DIR):
+    """Return (.npy path, .json path) of the cache entry for a raw file."""
+    key = cache_key(path)
+    stem = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}_{key[:16]}")
+    return stem + ".npy", stem + ".json"
+
+
+def decode_raw(path):
+    """
+    Decode a DNG with rawpy.
+    Returns:
+        raw_image: 2D uint16 sensor data (Bayer mosaic, no demosaicing)
+        metadata: dict with black levels, white level and CFA layout
+    """
+    import rawpy  # only needed on a cache miss
+
+    with rawpy.imread(path) as raw:
+        raw_image = np.array(raw.raw_image, dtype=np.uint16)
+        metadata = {
+            "source": os.path.abspath(path),
+            "shape": list(raw_image.shape),
+            "black_level_per_channel": [float(v) for v in raw.black_level_per_channel],
+            "white_level": float(raw.white_level),
+            # 2x2 CFA tile as channel indices into color_desc, e.g. [[0, 1], [3, 2]] for RGGB
+            "raw_pattern": np.asarray(raw.raw_pattern).tolist() if raw.raw_pattern is not None else None,
+            "color_desc": raw.color_desc.decode() if isinstance(raw.color_desc, bytes) else str(raw.color_desc),
+        }
+    return raw_image, metadata
+
+
+def load_raw_cached(path, cache_dir=RAW_CACHE_DIR):
+    """
+    Raw sensor data of a DNG through an on-disk decode cache.
+    The first load decodes with rawpy and stores the uint16 raw_image as .npy plus
+    its metadata as .json; later loads (same path, size and mtime) skip rawpy and
+    return a read-only np.memmap of the .npy, so nothing is decoded or copied
+    until pixels are actually read.
+
+    Args:
+        path: path to the DNG file
+        cache_dir: directory of the cache entries
+
+    Returns:
+        raw_image: 2D uint16 array (np.memmap on a cache hit)
+        metadata: dict, see decode_raw
+    """
+    npy_path, json_path = cache_paths(path, cache_dir)
+    if os.path.exists(npy_path) and os.path.exists(json_path):
+        with open(json_path) as f:
+            metadata = json.load(f)
+        # The .json mtime records the last use, for least recently used eviction
+        os.utime(json_path)
+        return np.load(npy_path, mmap_mode="r"), metadata
+
+    raw_image, metadata = decode_raw(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to temporary names and rename, a crash never leaves a half-written entry
+    # (the .json is renamed last, the entry only counts once both exist)
+    np.save(npy_path + ".tmp.npy", raw_image)
+    os.replace(npy_path + ".tmp.npy", npy_path)
+    with open(json_path + ".tmp", "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(json_path + ".tmp", json_path)
+    # The DNG changed (or is new): drop the entries of its older versions, then enforce the size cap
+    remove_entries(cache_dir, lambda stem, source: source == metadata["source"] and stem != npy_path[:-4])
+    prune_raw_cache(cache_dir=cache_dir)
+    return np.load(npy_path, mmap_mode="r"), metadata
+
+
+def cache_entries(cache_dir=RAW_CACHE_DIR):
+    """
+    Complete entries of the cache.
+    Returns:
+        list of (stem, source path, size in bytes, last use time), the entry files being stem + .npy / .json
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".json"):
+            continue
+        stem = os.path.join(cache_dir, name[:-5])
+        try:
+            with open(stem + ".json") as f:
+                source = json.load(f).get("source")
+            size = os.path.getsize(stem + ".npy") + os.path.getsize(stem + ".json")
+            last_use = os.path.getmtime(stem + ".json")
+        except (OSError, ValueError):
+            # Half-removed or unreadable entry, treated as stale
+            source, size, last_use = None, 0, 0.0
+        entries.append((stem, source, size, last_use))
+    return entries
+
+
+def remove_entries(cache_dir, is_stale):
+    """
+    Delete the entries for which is_stale(stem, source) is true.
+    Returns:
+        number of entries removed
+    """
+    removed = 0
+    for stem, source, _, _ in cache_entries(cache_dir):
+        if is_stale(stem, source):
+            for ext in (".json", ".npy"):
+                if os.path.exists(stem + ext):
+                    os.remove(stem + ext)
+            removed += 1
+    return removed
+
+
+def is_current(stem, source):
+    """True if the entry was made from the current version of its source file."""
+    if source is None or not os.path.exists(source):
+        return False
+    return stem.endswith("_" + cache_key(source)[:16])
+
+
+def prune_raw_cache(max_bytes=RAW_CACHE_MAX_BYTES, cache_dir=RAW_CACHE_DIR):
+    """
+    Clean up the cache: delete entries whose DNG was deleted or changed since it was
+    decoded, and .npy files left without their .json, then evict least recently used
+    entries until the cache holds at most max_bytes.
+
+    Args:
+        max_bytes: size cap in bytes, None for no cap
+        cache_dir: directory of the cache entries
+
+    Returns:
+        number of entries removed
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = remove_entries(cache_dir, lambda stem, source: not is_current(stem, source))
+    for name in os.listdir(cache_dir):
+        stem = os.path.join(cache_dir, name[:-4])
+        if name.endswith(".npy") and not name.endswith(".tmp.npy") and not os.path.exists(stem + ".json"):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+
+    if max_bytes is not None:
+        entries = sorted(cache_entries(cache_dir), key=lambda entry: entry[3])
+        total = sum(entry[2] for entry in entries)
+        evicted = set()
+        for stem, _, size, _ in entries:
+            if total <= max_bytes:
+                break
+            evicted.add(stem)
+            total -= size
+        removed += remove_entries(cache_dir, lambda stem, source: stem in evicted)
+    return removed
+
+
+def clear_raw_cache(cache_dir=RAW_CACHE_DIR):
+    """Delete every cache entry, returns the number of files removed."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith((".npy", ".json")):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    paths = sys.argv[1:] or ["./images/dark_1.dng"]
+    for path in paths:
+        for attempt in ("first load", "cached load"):
+            start = time.perf_counter()
+            raw_image, metadata = load_raw_cached(path)
+            mean = float(np.mean(raw_image, dtype=np.float64))
+            print(f"{os.path.basename(path)} {attempt}: {time.perf_counter() - start:.3f} s, "
+                  f"shape {raw_image.shape}, mean {mean:.2f}, black levels {metadata['black_level_per_channel']}")
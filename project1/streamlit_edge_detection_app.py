@@ -4,38 +4,197 @@ import numpy as np
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase, RTCConfiguration, WebRtcMode
 import av
 import os
+import time
+import threading
+from collections import deque
 from datetime import datetime
 from convolution_implementation import get_filters
+from filter_chain import FilterChain
 
 st.set_page_config(page_title="Webcam Filters", layout="wide")
 st.title("Webcam with Real-time Convolution Filters")
 
+# Frames kept in the rolling latency statistics
+LATENCY_WINDOW = 120
+# Preallocated side-by-side output frames; recv writes one while Save copies another
+FRAME_RING_SIZE = 3
+# (rows, cols) covered by the latency overlay, restored after encoding so the ring stays clean
+OVERLAY_SIZE = (150, 400)
+
+
+class LatencyTracker:
+    """
+    Rolling per-stage latency (decode, filter, encode, total), end-to-end lag and achieved FPS.
+    The stages only time recv; 'lag' also covers the time a frame waited in the
+    input queue, see add_lag.
+    """
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = {stage: deque(maxlen=window) for stage in ('decode', 'filter', 'encode', 'total', 'lag')}
+        self.output_times = deque(maxlen=window)
+        self.dropped = 0
+        self.min_offset = None
+
+    def add(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def add_lag(self, frame_time, now):
+        """
+        Record how far the output trails the capture clock.
+        frame_time is the frame's media time (frame.time, seconds since the stream
+        started), so now - frame_time is constant while frames go out as fast as
+        they arrive and grows with every second spent queued or filtering. The
+        smallest offset seen is taken as zero lag.
+        """
+        if frame_time is None:
+            return
+        offset = now - frame_time
+        if self.min_offset is None or offset < self.min_offset:
+            self.min_offset = offset
+        self.add('lag', offset - self.min_offset)
+
+    def frame_done(self):
+        self.output_times.append(time.perf_counter())
+
+    def fps(self):
+        if len(self.output_times) < 2:
+            return 0.0
+        span = self.output_times[-1] - self.output_times[0]
+        return (len(self.output_times) - 1) / span if span > 0 else 0.0
+
+    def summary(self):
+        """Returns dict stage -> (p50 ms, p95 ms) over the window."""
+        return {stage: tuple(np.percentile(np.asarray(values) * 1000, [50, 95]))
+                for stage, values in self.samples.items() if values}
+
+    def draw(self, img):
+        """Write the current stats onto img in place (top-left corner)."""
+        lines = [f"{stage}: p50 {p50:.1f} ms  p95 {p95:.1f} ms" for stage, (p50, p95) in self.summary().items()]
+        lines.append(f"fps: {self.fps():.1f}  dropped: {self.dropped}")
+        for i, line in enumerate(lines):
+            y = 22 + 20 * i
+            cv2.putText(img, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3, cv2.LINE_AA)
+            cv2.putText(img, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv2.LINE_AA)
+
+
 class VideoTransformer(VideoTransformerBase):
     def __init__(self):
-        self.filter_name = 'sobel_vertical'
         self.filters = get_filters()
-        self.last_original = None
-        self.last_filtered = None
+        self.chain_spec = None
+        self.set_chain([('kernel', 'sobel_vertical')])
+        # Ring of composite [original | filtered] frames, allocated on the first frame
+        self.ring = None
+        self.overlay_backup = None
+        self.latest = None  # ring index of the newest complete frame
+        self.ring_lock = threading.Lock()
+        self.show_latency = True
+        self.latency = LatencyTracker()
+
+    async def recv_queued(self, frames):
+        """
+        Called with every frame queued since the last call (async_processing=True).
+        Like the streamlit-webrtc default only the newest frame is filtered; the
+        stale ones are counted so the overlay shows how many were dropped.
+        """
+        self.latency.dropped += len(frames) - 1
+        return [self.recv(frames[-1])]
+
+    def set_chain(self, steps):
+        """
+        Swap in a new filter chain while the stream keeps running.
+        The app passes the sidebar selection on every rerun, a chain is only built
+        when it differs from the current one. The swap is a single attribute
+        assignment: recv reads self.chain once per frame, so every frame runs
+        entirely with either the old or the new chain.
+        """
+        spec = tuple(tuple(step) for step in steps)
+        if spec != self.chain_spec:
+            self.chain = FilterChain(spec, self.filters)
+            self.chain_spec = spec
+
+    def allocate_ring(self, h, w):
+        """(Re)allocate the output ring for h x w input frames."""
+        with self.ring_lock:
+            self.ring = np.zeros((FRAME_RING_SIZE, h, 2 * w, 3), dtype=np.uint8)
+            self.overlay_backup = np.empty((min(OVERLAY_SIZE[0], h), min(OVERLAY_SIZE[1], 2 * w), 3),
+                                           dtype=np.uint8)
+            self.latest = None
+
+    def snapshot(self):
+        """
+        Copy of the newest frame pair, the only copy made for saving.
+        Returns:
+            (original, filtered) BGR arrays, or None before the first frame
+        """
+        with self.ring_lock:
+            if self.latest is None:
+                return None
+            composite = self.ring[self.latest]
+            w = composite.shape[1] // 2
+            return composite[:, :w].copy(), composite[:, w:].copy()
 
     def recv(self, frame):
+        start = time.perf_counter()
         img = frame.to_ndarray(format="bgr24")
-        kernel = self.filters[self.filter_name]
-        filtered = cv2.filter2D(img, -1, kernel)
+        decoded = time.perf_counter()
 
-        if 'sobel' in self.filter_name or 'emboss' in self.filter_name:
-            filtered = cv2.cvtColor(filtered, cv2.COLOR_BGR2GRAY)
-            filtered = cv2.cvtColor(filtered, cv2.COLOR_GRAY2BGR)
+        h, w = img.shape[:2]
+        if self.ring is None or self.ring.shape[1:3] != (h, 2 * w):
+            self.allocate_ring(h, w)
+        # Next slot after the newest one, never the frame a snapshot may be copying
+        slot_index = 0 if self.latest is None else (self.latest + 1) % FRAME_RING_SIZE
+        composite = self.ring[slot_index]
+        left, right = composite[:, :w], composite[:, w:]
 
-        filtered = np.clip(filtered, 0, 255).astype(np.uint8)
-        self.last_original = img.copy()
-        self.last_filtered = filtered.copy()
+        # Original and filtered halves are written in place, no per-frame allocations
+        np.copyto(left, img)
+        # One read of the chain per frame, a swap from the app lands between frames
+        chain = self.chain
+        chain.apply(img, right)
+        filtered_at = time.perf_counter()
+
+        if self.show_latency:
+            # Draw on the slot, encode, then put the pixels under the overlay back
+            oh, ow = self.overlay_backup.shape[:2]
+            np.copyto(self.overlay_backup, composite[:oh, :ow])
+            self.latency.draw(composite)
+            out = av.VideoFrame.from_ndarray(composite, format="bgr24")
+            np.copyto(composite[:oh, :ow], self.overlay_backup)
+        else:
+            out = av.VideoFrame.from_ndarray(composite, format="bgr24")
+        with self.ring_lock:
+            self.latest = slot_index
+        done = time.perf_counter()
 
-        return av.VideoFrame.from_ndarray(np.hstack([img, filtered]), format="bgr24")
+        self.latency.add('decode', decoded - start)
+        self.latency.add('filter', filtered_at - decoded)
+        self.latency.add('encode', done - filtered_at)
+        self.latency.add('total', done - start)
+        self.latency.add_lag(frame.time, done)
+        self.latency.frame_done()
+        return out
 
 # --- Sidebar: quick controls ---
-st.sidebar.title("Select Filter:")
-selected_filter = st.sidebar.selectbox("Choose", list(get_filters().keys()), index=1)
-st.sidebar.markdown("###### After changing filter, restart the webcam stream to apply.")
+st.sidebar.title("Filter Chain:")
+# Applied in the order they are selected; changes take effect on the next frame
+MEDIAN_STEP = "median"
+EQUALIZE_STEP = "equalize histogram"
+SOBEL_STEP = "sobel threshold"
+selected_steps = st.sidebar.multiselect(
+    "Steps", list(get_filters().keys()) + [MEDIAN_STEP, EQUALIZE_STEP, SOBEL_STEP],
+    default=[list(get_filters().keys())[1]])
+median_size = st.sidebar.slider("Median size", 3, 15, 5, step=2)
+sobel_threshold = st.sidebar.slider("Sobel threshold", 0, 1000, 100, step=10)
+chain_steps = []
+for step in selected_steps:
+    if step == MEDIAN_STEP:
+        chain_steps.append(('median', median_size))
+    elif step == EQUALIZE_STEP:
+        chain_steps.append(('equalize',))
+    elif step == SOBEL_STEP:
+        chain_steps.append(('sobel', sobel_threshold))
+    else:
+        chain_steps.append(('kernel', step))
+show_latency = st.sidebar.checkbox("Show latency overlay", value=True)
 
 # --- Main: place Start/Stop and Save side-by-side ---
 col_left, col_right = st.columns([3, 1])
@@ -54,9 +213,10 @@ with col_left:
         async_processing=True,
     )
 
-# keep transformer in sync with selected filter
+# keep transformer in sync with the selected chain, swapped live without restarting the stream
 if webrtc_ctx.video_transformer:
-    webrtc_ctx.video_transformer.filter_name = selected_filter
+    webrtc_ctx.video_transformer.set_chain(chain_steps)
+    webrtc_ctx.video_transformer.show_latency = show_latency
 
 with col_right:
     st.markdown("##### Save Original and Convolved Frame to outputs folder")
@@ -65,14 +225,16 @@ with col_right:
 
     if save_clicked:
         vt = webrtc_ctx.video_transformer
-        if vt and vt.last_original is not None and vt.last_filtered is not None:
+        frames = vt.snapshot() if vt else None
+        if frames is not None:
+            last_original, last_filtered = frames
             os.makedirs("./outputs/out_conv", exist_ok=True)
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            base = f"./outputs/out_conv/frame_{ts}_{selected_filter}"
+            base = f"./outputs/out_conv/frame_{ts}_{vt.chain.describe()}"
             orig_path = f"{base}_orig.png"
             filt_path = f"{base}_filtered.png"
-            ok1 = cv2.imwrite(orig_path, vt.last_original)
-            ok2 = cv2.imwrite(filt_path, vt.last_filtered)
+            ok1 = cv2.imwrite(orig_path, last_original)
+            ok2 = cv2.imwrite(filt_path, last_filtered)
             if ok1 and ok2:
                 st.success("Saved!")
                 st.caption(f"• {orig_path}\n\n• {filt_path}")
@@ -0,0 +1,329 @@
+"""
+Offline video filtering, headless counterpart of the webcam app.
+
+Reads a video file, runs every frame through a filter chain (the get_filters()
+kernels plus median / equalize / sobel steps, see filter_chain.FilterChain) or
+through an image_processing operator, writes the result and reports throughput.
+
+Decode, filter and encode run as overlapping stages: a decoder thread reads
+frames and submits them to a pool of filter workers, the futures travel through
+a bounded queue (so at most --queue-size frames are in flight and memory stays
+flat), and the main thread encodes them in frame order as they complete.
+
+Usage:
+    python video_filter_cli.py input.mp4 output.mp4 --chain gaussian,median:5
+    python video_filter_cli.py input.mp4 output.mp4 --chain sobel:100 --workers 4
+    python video_filter_cli.py input.mp4 output.mp4 --op median_filter:9 --backend process
+    python video_filter_cli.py input.mp4 --chain sharpening --serial     # no output, serial baseline
+
+Chain steps: a get_filters() kernel name, median:<size>, equalize, sobel:<threshold>.
+Operators (image_processing, run on the grayscale frame): convolution:<filter>,
+median_filter:<size>, equalize_histogram, contrast_stretch, sobel_edge_detector:<threshold|otsu>.
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from convolution_implementation import get_filters
+from filter_chain import FilterChain
+
+IMAGE_PROCESSING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_processing")
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,    # OpenCV and numpy release the GIL
+    'process': ProcessPoolExecutor,  # operators with Python-level loops
+}
+
+OPERATORS = ['convolution', 'median_filter', 'equalize_histogram', 'contrast_stretch', 'sobel_edge_detector']
+
+# Per-worker filters: chains own reusable buffers, so every thread (or process) builds its own
+WORKER = threading.local()
+
+
+def parse_chain(text):
+    """
+    Parse 'gaussian,median:5,equalize,sobel:100' into FilterChain steps.
+    """
+    filters = get_filters()
+    steps = []
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, param = item.partition(':')
+        if name in filters:
+            steps.append(('kernel', name))
+        elif name == 'median':
+            steps.append(('median', int(param or 5)))
+        elif name == 'equalize':
+            steps.append(('equalize',))
+        elif name == 'sobel':
+            steps.append(('sobel', float(param or 100)))
+        else:
+            raise ValueError(f"Unknown chain step: {item} (kernels: {', '.join(filters)})")
+    return tuple(steps)
+
+
+def load_operator(name, param):
+    """
+    Function of a grayscale uint8 frame returning a uint8 frame, from image_processing.
+    Args:
+        name: one of OPERATORS
+        param: operator parameter as given after ':' on the command line, or ''
+    """
+    if IMAGE_PROCESSING_DIR not in sys.path:
+        sys.path.append(IMAGE_PROCESSING_DIR)
+
+    if name == 'convolution':
+        from utils import apply_convolution, get_filters as get_image_filters
+        kernel = get_image_filters()[param or 'gaussian']
+        return lambda gray: apply_convolution(gray, kernel)
+    if name == 'median_filter':
+        from median_filter import median_filter
+        size = int(param or 3)
+        return lambda gray: median_filter(gray, size)
+    if name == 'equalize_histogram':
+        from equalize_histogram import equalize_histogram
+        return lambda gray: equalize_histogram(gray)
+    if name == 'contrast_stretch':
+        from contrast_stretch import contrast_stretch
+        return lambda gray: contrast_stretch(gray, int(gray.min()), int(gray.max()) + 1)
+    if name == 'sobel_edge_detector':
+        from sobel_edge_detector import sobel_edge_detector
+        threshold = param or 'otsu'
+        threshold = threshold if threshold in ('otsu', 'percentile') else float(threshold)
+        return lambda gray: sobel_edge_detector(gray, threshold, verbose=False)
+    raise ValueError(f"Unknown operator: {name} (available: {', '.join(OPERATORS)})")
+
+
+def build_filter(spec):
+    """
+    Frame filter (BGR uint8 in, BGR uint8 out) of a spec:
+        ('chain', steps) or ('op', name, param)
+    """
+    if spec[0] == 'chain':
+        chain = FilterChain(spec[1])
+        return lambda frame: chain.apply(frame, np.empty_like(frame))
+
+    operator = load_operator(spec[1], spec[2])
+
+    def apply_operator(frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.cvtColor(np.asarray(operator(gray), dtype=np.uint8), cv2.COLOR_GRAY2BGR)
+    return apply_operator
+
+
+def filter_frame(spec, frame):
+    """
+    Filter one frame in a worker, building the worker's filter on first use.
+    Module-level (picklable) so it also runs in a process pool.
+    Returns:
+        filtered frame, start and end of the filtering (time.time(), comparable
+        across worker processes)
+    """
+    filters = getattr(WORKER, 'filters', None)
+    if filters is None:
+        filters = WORKER.filters = {}
+    if spec not in filters:
+        filters[spec] = build_filter(spec)
+    start = time.time()
+    out = filters[spec](frame)
+    return out, start, time.time()
+
+
+def add_filter_time(stats, start, end):
+    """Accumulate the busy time of the filter stage and the span it was active over."""
+    stats['filter_s'] += end - start
+    stats['filter_first'] = min(stats.get('filter_first', start), start)
+    stats['filter_last'] = max(stats.get('filter_last', end), end)
+
+
+def open_video(input_path):
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video: {input_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    return capture, fps if fps and fps > 0 else 30.0
+
+
+def open_writer(output_path, fps, frame, codec='mp4v'):
+    if output_path is None:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    h, w = frame.shape[:2]
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*codec), fps, (w, h))
+    if not writer.isOpened():
+        raise IOError(f"Could not open video writer: {output_path} ({codec})")
+    return writer
+
+
+def run_pipeline(input_path, output_path, spec, workers=None, backend='thread',
+                 queue_size=8, max_frames=None, codec='mp4v'):
+    """
+    Decode, filter and encode a video as overlapping stages.
+    Args:
+        input_path: video file readable by cv2.VideoCapture
+        output_path: output video file, or None to only measure throughput
+        spec: filter spec, see build_filter
+        workers: filter workers, defaults to os.cpu_count()
+        backend: 'thread' or 'process'
+        queue_size: frames in flight between decoder and encoder (the bounded queue)
+        max_frames: stop after this many frames
+        codec: FourCC of the output video
+    Returns:
+        stats: dict with frames, wall seconds, fps and the busy seconds of every stage
+    """
+    workers = workers or os.cpu_count() or 1
+    capture, fps = open_video(input_path)
+    # Filtered frames in decode order, the queue bound is the backpressure on the decoder
+    pending = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    stats = {'frames': 0, 'decode_s': 0.0, 'filter_s': 0.0, 'encode_s': 0.0}
+    writer = None
+
+    with EXECUTORS[backend](max_workers=workers) as pool:
+        def decode():
+            n = 0
+            try:
+                while not stop.is_set() and (max_frames is None or n < max_frames):
+                    start = time.perf_counter()
+                    ok, frame = capture.read()
+                    stats['decode_s'] += time.perf_counter() - start
+                    if not ok:
+                        break
+                    future = pool.submit(filter_frame, spec, frame)
+                    while not stop.is_set():
+                        try:
+                            pending.put(future, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    n += 1
+            finally:
+                pending.put(None)
+
+        start = time.perf_counter()
+        decoder = threading.Thread(target=decode, daemon=True)
+        decoder.start()
+        try:
+            while (future := pending.get()) is not None:
+                out, filter_start, filter_end = future.result()
+                add_filter_time(stats, filter_start, filter_end)
+                encode_start = time.perf_counter()
+                if writer is None:
+                    writer = open_writer(output_path, fps, out, codec)
+                if writer is not None:
+                    writer.write(out)
+                stats['encode_s'] += time.perf_counter() - encode_start
+                stats['frames'] += 1
+        finally:
+            stop.set()
+            # Unblock the decoder if it is waiting on a full queue
+            while decoder.is_alive():
+                try:
+                    pending.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            decoder.join()
+            capture.release()
+            if writer is not None:
+                writer.release()
+
+    stats['wall_s'] = time.perf_counter() - start
+    stats['fps'] = stats['frames'] / stats['wall_s'] if stats['wall_s'] > 0 else 0.0
+    stats['workers'] = workers
+    return stats
+
+
+def run_serial(input_path, output_path, spec, max_frames=None, codec='mp4v'):
+    """
+    Same work as run_pipeline in one loop (decode, filter, encode one frame at a time), the baseline.
+    """
+    capture, fps = open_video(input_path)
+    stats = {'frames': 0, 'decode_s': 0.0, 'filter_s': 0.0, 'encode_s': 0.0, 'workers': 1}
+    writer = None
+    start = time.perf_counter()
+    try:
+        while max_frames is None or stats['frames'] < max_frames:
+            t0 = time.perf_counter()
+            ok, frame = capture.read()
+            stats['decode_s'] += time.perf_counter() - t0
+            if not ok:
+                break
+            out, filter_start, filter_end = filter_frame(spec, frame)
+            add_filter_time(stats, filter_start, filter_end)
+            t0 = time.perf_counter()
+            if writer is None:
+                writer = open_writer(output_path, fps, out, codec)
+            if writer is not None:
+                writer.write(out)
+            stats['encode_s'] += time.perf_counter() - t0
+            stats['frames'] += 1
+    finally:
+        capture.release()
+        if writer is not None:
+            writer.release()
+    stats['wall_s'] = time.perf_counter() - start
+    stats['fps'] = stats['frames'] / stats['wall_s'] if stats['wall_s'] > 0 else 0.0
+    return stats
+
+
+def print_stats(stats, label):
+    frames = max(stats['frames'], 1)
+    print(f"{label}: {stats['frames']} frames in {stats['wall_s']:.2f} s -> {stats['fps']:.1f} fps "
+          f"({stats['workers']} filter worker(s))")
+    for stage in ('decode', 'filter', 'encode'):
+        busy = stats[f'{stage}_s']
+        print(f"  {stage:<7} {busy / frames * 1000:7.2f} ms/frame busy")
+    # Measured: frames over the wall-clock span from the first filter start to the last filter end
+    span = stats.get('filter_last', 0.0) - stats.get('filter_first', 0.0)
+    filter_fps = stats['frames'] / span if span > 0 else 0.0
+    print(f"  filter stage: {filter_fps:.1f} fps measured over its {span:.2f} s wall-clock span")
+    # Not measured: assumes the workers scale perfectly and never wait for decoded frames
+    upper_bound = frames * stats['workers'] / stats['filter_s'] if stats['filter_s'] > 0 else 0.0
+    print(f"  filter upper bound (perfect scaling, no waits): {upper_bound:.1f} fps")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter a video file offline and report throughput")
+    parser.add_argument("input", help="input video file")
+    parser.add_argument("output", nargs="?", help="output video file (omit to only measure throughput)")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--chain", help="filter chain, e.g. 'gaussian,median:5,sobel:100'")
+    group.add_argument("--op", help=f"image_processing operator[:param], one of {', '.join(OPERATORS)}")
+    parser.add_argument("--workers", type=int, help="filter workers (default: all cores)")
+    parser.add_argument("--backend", choices=list(EXECUTORS), default='thread', help="filter worker pool")
+    parser.add_argument("--queue-size", type=int, default=8, help="frames in flight between the stages")
+    parser.add_argument("--max-frames", type=int, help="stop after this many frames")
+    parser.add_argument("--codec", default='mp4v', help="FourCC of the output video")
+    parser.add_argument("--serial", action="store_true", help="run decode/filter/encode in one loop instead")
+    args = parser.parse_args()
+
+    if args.chain:
+        try:
+            spec = ('chain', parse_chain(args.chain))
+        except ValueError as e:
+            parser.error(str(e))
+        label = FilterChain(spec[1]).describe()
+    else:
+        name, _, param = args.op.partition(':')
+        if name not in OPERATORS:
+            parser.error(f"unknown operator {name}, choose from {', '.join(OPERATORS)}")
+        spec = ('op', name, param)
+        label = args.op
+
+    if args.serial:
+        stats = run_serial(args.input, args.output, spec, args.max_frames, args.codec)
+    else:
+        stats = run_pipeline(args.input, args.output, spec, args.workers, args.backend,
+                             args.queue_size, args.max_frames, args.codec)
+    print_stats(stats, f"{label} ({'serial' if args.serial else args.backend + ' pipeline'})")
+    if args.output:
+        print(f"Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()